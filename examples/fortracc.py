@@ -8,5 +8,5 @@
 
 from tathu.fortracc import Fortracc
 
-f = Fortracc(threshold=235, resolution=2.0)
-f.run('./data/noaa-goes16/**/*.nc')
+with Fortracc(threshold=235, resolution=2.0) as f:
+    f.run('./data/noaa-goes16/**/*.nc')
@@ -30,3 +30,22 @@ SELECT event, date_time FROM systems WHERE name='x';
 
 -- Calcula os centroides do sistema convectivo de nome 'x' para cada instante de tempo.
 SELECT name, ST_AsText(ST_Centroid(geom)), date_time FROM systems WHERE name = 'x' ORDER BY(date_time);
+
+-- Quais sistemas convectivos ocorreram no dia x? (intervalo de tempo; usa o índice de date_time)
+SELECT name, date_time FROM systems WHERE date_time >= '2017-09-30 00:00:00' AND date_time < '2017-10-01 00:00:00';
+
+-- Verifica se a consulta usa os índices (esperado: SEARCH systems USING INDEX idx_systems_date_time)
+EXPLAIN QUERY PLAN SELECT name, date_time FROM systems WHERE date_time >= '2017-09-30 00:00:00' AND date_time < '2017-10-01 00:00:00';
+
+-- Consultas usando a tabela de resumo das famílias (mantida pelo Outputter; sem varrer a tabela systems)
+-- Qual o tempo de vida média dos sistemas convectivos?
+SELECT AVG(duration) FROM systems_families;
+
+-- Qual sistema convectivo durou mais tempo?
+SELECT name, duration FROM systems_families ORDER BY duration DESC LIMIT 1;
+
+-- Quantos sistemas convectivos foram detectados em apenas um instante (i.e. em uma única imagem)?
+SELECT COUNT(*) FROM systems_families WHERE nsystems = 1;
+
+-- Quantos sistemas convectivos tiveram divisão (split) ou fusão (merge)?
+SELECT SUM(has_split), SUM(has_merge) FROM systems_families;
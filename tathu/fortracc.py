@@ -15,9 +15,10 @@ from shapely.errors import ShapelyDeprecationWarning
 
 from tathu.constants import LAT_LON_WGS84
 from tathu.io import spatialite
+from tathu.io.background import BackgroundOutputter
 from tathu.satellite import goes_r
 from tathu.tracking import descriptors, detectors, trackers
-from tathu.tracking.utils import area2degrees
+from tathu.tracking.utils import area2degrees, simplify
 from tathu.utils import file2timestamp
 
 warnings.filterwarnings('ignore', category=ShapelyDeprecationWarning)
@@ -51,6 +52,9 @@ class Fortracc:
         movement_attrs=None,
         db_path='systems-db-fortracc.sqlite',
         db_table='systems',
+        release_rasters=False,
+        simplify_tolerance=None,
+        background_output=False,
     ):
         # Parameters
         self.extent = extent or [-100.0, -56.0, -20.0, 15.0]
@@ -62,12 +66,32 @@ class Fortracc:
         self.stats_attrs = stats_attrs or ['min', 'mean', 'std', 'median', 'count']
         self.movement_attrs = movement_attrs or ['nae', 'velocity', 'u', 'v', 'direction']
 
+        # Polygon simplification (None: disabled; 0.0: collinear vertices only)
+        self.simplify_tolerance = simplify_tolerance
+
+        # Memory-bounded mode: release system rasters once they are persisted
+        self.release_rasters = release_rasters
+
         # Initialize Spatialite output
         self.db = spatialite.Outputter(db_path, db_table, self.stats_attrs + self.movement_attrs)
 
+        # Write on a dedicated thread, i.e. output does not block the tracking loop
+        if background_output:
+            self.db = BackgroundOutputter(self.db)
+
         # Tracking strategy
         self.strategy = trackers.RelativeOverlapAreaStrategy(self.overlap_area_criterion)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''Write pending frames and close the output database.'''
+        self.db.close()
+
     def detect(self, path):
         '''Detect convective systems in a GOES image.'''
         timestamp = file2timestamp(path, regex=goes_r.DATE_REGEX, format=goes_r.DATE_FORMAT)
@@ -96,6 +120,12 @@ class Fortracc:
         descriptor = descriptors.StatisticalDescriptor(stats=self.stats_attrs, rasterOut=True)
         descriptor.describe(grid, systems)
 
+        # Simplify polygons, if requested. Note: after describe, i.e. statistics and
+        # mini-rasters are computed on the detected pixel footprint
+        if self.simplify_tolerance is not None:
+            before, after = simplify(systems, self.simplify_tolerance)
+            print(f'Simplified polygons: {before} -> {after} vertices')
+
         # Add movement attributes (to be computed later)
         for s in systems:
             s.addAtributes(self.movement_attrs)
@@ -110,32 +140,43 @@ class Fortracc:
             print('No image files provided.')
             return
 
-        # Detect first timestep
-        previous = self.detect(files[0])
-        self.db.output(previous)
+        try:
+            # Detect first timestep
+            previous = self.detect(files[0])
+            self.output(previous)
 
-        # Process subsequent files
-        for i in range(1, len(files)):
-            current = self.detect(files[i])
+            # Process subsequent files
+            for i in range(1, len(files)):
+                current = self.detect(files[i])
 
-            # Track systems
-            tracker = trackers.OverlapAreaTracker(previous, strategy=self.strategy)
-            tracker.track(current)
+                # Track systems
+                tracker = trackers.OverlapAreaTracker(previous, strategy=self.strategy)
+                tracker.track(current)
 
-            # Compute additional descriptors
-            nae_desc = descriptors.NormalizedAreaExpansionDescriptor()
-            nae_desc.describe(previous, current)
+                # Compute additional descriptors
+                nae_desc = descriptors.NormalizedAreaExpansionDescriptor()
+                nae_desc.describe(previous, current)
 
-            move_desc = descriptors.MovementDescriptor()
-            move_desc.describe(previous, current)
+                move_desc = descriptors.MovementDescriptor()
+                move_desc.describe(previous, current)
 
-            # Save results
-            self.db.output(current)
+                # Save results
+                self.output(current)
 
-            previous = current
+                previous = current
+        finally:
+            # Write and commit pending frames, even on error
+            self.db.flush()
 
+        print(f'Output throughput: {self.db.getThroughput():.1f} systems/s')
         print('Tracking completed successfully.')
 
+    def output(self, systems):
+        '''Persist systems and, if requested, release their rasters.'''
+        self.db.output(systems)
+        if self.release_rasters:
+            self.db.release(systems)
+
     def run(self, image_pattern='./data/noaa-goes16/**/*.nc'):
         '''Convenience method to run ForTraCC over a file pattern.'''
         files = sorted(glob.glob(image_pattern, recursive=True))
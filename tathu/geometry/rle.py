@@ -0,0 +1,130 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+'''
+Run-length encoding (RLE) of system footprints (label masks).
+
+A footprint is a NumpyArray (N x 3) of int32 runs (row, start, end), sorted by row,
+where end is exclusive. Rows and columns are grid coordinates, i.e. pixel indexes
+relative to the grid origin, so footprints of the same grid can be compared directly.
+'''
+
+import numpy as np
+from osgeo import ogr
+
+from tathu.geometry.utils import extent2polygon
+
+def gridOrigin(geotransform):
+    '''
+    Returns the grid coordinates (row, col) of the upper-left pixel of the given geotransform.
+    '''
+    return int(round(geotransform[3] / geotransform[5])), int(round(geotransform[0] / geotransform[1]))
+
+def mask2rle(mask, geotransform):
+    '''
+    This method encodes the given boolean mask (True: system pixel) to runs.
+    '''
+    mask = np.asarray(mask, dtype=np.int8)
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    ends = np.nonzero(d == -1)[1]
+    row0, col0 = gridOrigin(geotransform)
+    return np.column_stack((rows + row0, starts + col0, ends + col0)).astype(np.int32)
+
+def raster2rle(raster, geotransform):
+    '''
+    This method encodes the footprint (non-masked pixels) of the given system raster to runs.
+    '''
+    return mask2rle(~np.ma.getmaskarray(raster), geotransform)
+
+def rle2mask(runs):
+    '''
+    This method decodes the given runs to a boolean mask.
+    \return The mask and its grid coordinates (row, col) origin.
+    '''
+    row0, col0 = runs[:, 0].min(), runs[:, 1].min()
+    mask = np.zeros((runs[:, 0].max() - row0 + 1, runs[:, 2].max() - col0), dtype=bool)
+    for row, start, end in runs:
+        mask[row - row0, start - col0:end - col0] = True
+    return mask, (row0, col0)
+
+def rle2polygon(runs, geotransform):
+    '''
+    This method builds the pixel-staircase polygon of the given runs, using the
+    geotransform of the grid (or of any system of the grid) to locate the pixels.
+    '''
+    row0, col0 = gridOrigin(geotransform)
+    x = geotransform[0] + (runs[:, 1:] - col0) * geotransform[1]
+    top = geotransform[3] + (runs[:, 0] - row0) * geotransform[5]
+    bottom = top + geotransform[5]
+    # One rectangle per run
+    rectangles = ogr.Geometry(ogr.wkbMultiPolygon)
+    for (xmin, xmax), ymax, ymin in zip(x, top, bottom):
+        rectangles.AddGeometry(extent2polygon((xmin, ymin, xmax, ymax)))
+    return rectangles.UnionCascaded()
+
+def area(runs):
+    '''
+    Returns the number of pixels of the given runs.
+    '''
+    return int((runs[:, 2] - runs[:, 1]).sum())
+
+def extent(runs):
+    '''
+    Returns the grid extent (rowmin, colmin, rowmax, colmax) of the given runs. Max is exclusive.
+    '''
+    return runs[:, 0].min(), runs[:, 1].min(), runs[:, 0].max() + 1, runs[:, 2].max()
+
+def intersection(a, b):
+    '''
+    Returns the number of common pixels of the given runs, without decoding them.
+    '''
+    if not len(a) or not len(b):
+        return 0
+    # Runs of b on the same row of each run of a
+    lo = np.searchsorted(b[:, 0], a[:, 0], 'left')
+    hi = np.searchsorted(b[:, 0], a[:, 0], 'right')
+    counts = hi - lo
+    if not counts.any():
+        return 0
+    ia = np.repeat(np.arange(len(a)), counts)
+    ib = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    overlap = np.minimum(a[ia, 2], b[ib, 2]) - np.maximum(a[ia, 1], b[ib, 1])
+    return int(np.clip(overlap, 0, None).sum())
+
+def iou(a, b):
+    '''
+    Returns the intersection over union (IoU) of the given runs.
+    '''
+    common = intersection(a, b)
+    union = area(a) + area(b) - common
+    return common / union if union else 0.0
+
+def overlaps(footprints, others, min_iou=0.0):
+    '''
+    Computes the overlaps between two lists of footprints.
+    Pairs are first filtered by their grid extents.
+    \return List of (i, j, intersection, iou), with indexes of footprints and others.
+    '''
+    results = []
+    if not footprints or not others:
+        return results
+    ea = np.array([extent(r) for r in footprints])
+    eb = np.array([extent(r) for r in others])
+    candidates = ((ea[:, None, 0] < eb[None, :, 2]) & (eb[None, :, 0] < ea[:, None, 2]) &
+                  (ea[:, None, 1] < eb[None, :, 3]) & (eb[None, :, 1] < ea[:, None, 3]))
+    for i, j in zip(*np.nonzero(candidates)):
+        common = intersection(footprints[i], others[j])
+        if not common:
+            continue
+        value = common / (area(footprints[i]) + area(others[j]) - common)
+        if value > min_iou:
+            results.append((int(i), int(j), common, value))
+    return results
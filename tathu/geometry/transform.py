@@ -6,14 +6,14 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
-import copy
+import struct
 from datetime import timedelta
 
+import numpy as np
 from osgeo import ogr
-from shapely import affinity, wkb
+from shapely import wkb
 
-from tathu.tracking.forecasters import delta
-from tathu.tracking.system import LifeCycleEvent
+from tathu.tracking.system import ConvectiveSystem, LifeCycleEvent
 
 def ogr2shapely(geom):
     return wkb.loads(bytes(geom.ExportToWkb()))
@@ -21,34 +21,235 @@ def ogr2shapely(geom):
 def shapely2ogr(geom):
     return ogr.CreateGeometryFromWkb(geom.wkb)
 
+### @begin-Affine transforms. ###
+
+# WKB geometry types that are collections of sub-geometries
+_WKB_COLLECTIONS = (4, 5, 6, 7)
+
+def _wkbDimension(type):
+    '''
+    Auxiliary function that returns the base type and the number of
+    dimensions of a WKB geometry type (2D, 2.5D and ISO Z/M/ZM flavours).
+    '''
+    if type & 0x80000000:
+        return type & 0xFF, 3
+    return type % 1000, (2, 3, 3, 4)[type // 1000]
+
+def _wkbCoordinateBlocks(buffer, offset, blocks):
+    '''
+    Auxiliary function that walks a little-endian WKB buffer and collects
+    its coordinate blocks as (offset, number of points, dimensions).
+    It returns the offset of the end of the geometry.
+    '''
+    type = struct.unpack_from('<I', buffer, offset + 1)[0]
+    base, dims = _wkbDimension(type)
+    offset += 5
+    if base == 1: # Point
+        blocks.append((offset, 1, dims))
+        return offset + 8 * dims
+    if base == 2: # LineString
+        n = struct.unpack_from('<I', buffer, offset)[0]
+        blocks.append((offset + 4, n, dims))
+        return offset + 4 + 8 * dims * n
+    if base == 3: # Polygon
+        nrings = struct.unpack_from('<I', buffer, offset)[0]
+        offset += 4
+        for i in range(nrings):
+            n = struct.unpack_from('<I', buffer, offset)[0]
+            blocks.append((offset + 4, n, dims))
+            offset += 4 + 8 * dims * n
+        return offset
+    if base in _WKB_COLLECTIONS:
+        ngeoms = struct.unpack_from('<I', buffer, offset)[0]
+        offset += 4
+        for i in range(ngeoms):
+            offset = _wkbCoordinateBlocks(buffer, offset, blocks)
+        return offset
+    raise ValueError('Unsupported WKB geometry type: ' + str(type))
+
+def _getCenter(geom):
+    llx, urx, lly, ury = geom.GetEnvelope()
+    return (llx + urx) * 0.5, (lly + ury) * 0.5
+
+def _getOrigins(geoms, origin):
+    if origin == 'center':
+        return np.array([_getCenter(g) for g in geoms], dtype=np.float64).reshape(-1, 2)
+    return np.tile(np.asarray(origin, dtype=np.float64), (len(geoms), 1))
+
+def affineMany(geoms, matrices):
+    '''
+    This method applies affine transforms to a list of OGR geometries at once.
+    The coordinates of all geometries are transformed directly on their
+    WKB buffers, using a single vectorized operation.
+    \param geoms List of OGR geometries.
+    \param matrices Affine matrix [a, b, d, e, xoff, yoff] (shared) or one matrix per geometry (N x 6).
+                    x' = a * x + b * y + xoff; y' = d * x + e * y + yoff.
+    \return List of transformed OGR geometries.
+    '''
+    if not geoms:
+        return []
+
+    matrices = np.asarray(matrices, dtype=np.float64)
+
+    # Collect coordinate blocks of all geometries
+    buffers, blocks, counts = [], [], []
+    for g in geoms:
+        buffer = bytearray(g.ExportToWkb(ogr.wkbNDR))
+        gblocks = []
+        _wkbCoordinateBlocks(buffer, 0, gblocks)
+        buffers.append(buffer)
+        blocks.append(gblocks)
+        counts.append(sum(n for offset, n, dims in gblocks))
+
+    # Writable views (x, y) for each coordinate block
+    views = []
+    for buffer, gblocks in zip(buffers, blocks):
+        for offset, n, dims in gblocks:
+            view = np.frombuffer(buffer, dtype='<f8', count=n * dims, offset=offset).reshape(n, dims)
+            views.append(view[:, :2])
+
+    coords = np.concatenate(views) if views else np.zeros((0, 2))
+
+    # Matrix for each point
+    if matrices.ndim == 2:
+        matrices = np.repeat(matrices, counts, axis=0)
+
+    x, y = coords[:, 0], coords[:, 1]
+    a, b, d, e, xoff, yoff = matrices.T
+    transformed = np.empty_like(coords)
+    transformed[:, 0] = a * x + b * y + xoff
+    transformed[:, 1] = d * x + e * y + yoff
+
+    # Write back and rebuild geometries
+    start = 0
+    for view in views:
+        view[...] = transformed[start:start + len(view)]
+        start += len(view)
+
+    result = []
+    for g, buffer in zip(geoms, buffers):
+        t = ogr.CreateGeometryFromWkb(bytes(buffer))
+        srs = g.GetSpatialReference()
+        if srs is not None:
+            t.AssignSpatialReference(srs)
+        result.append(t)
+
+    return result
+
+def affine(geom, matrix):
+    return affineMany([geom], matrix)[0]
+
+def translateMany(geoms, x, y):
+    x = np.broadcast_to(np.asarray(x, dtype=np.float64), (len(geoms),))
+    y = np.broadcast_to(np.asarray(y, dtype=np.float64), (len(geoms),))
+    ones, zeros = np.ones(len(geoms)), np.zeros(len(geoms))
+    return affineMany(geoms, np.column_stack((ones, zeros, zeros, ones, x, y)))
+
+def rotateMany(geoms, angle, origin='center'):
+    '''
+    Rotates the geometries by the given angle (degrees, counter-clockwise).
+    '''
+    angle = np.radians(np.broadcast_to(np.asarray(angle, dtype=np.float64), (len(geoms),)))
+    x0, y0 = _getOrigins(geoms, origin).T
+    cos, sin = np.cos(angle), np.sin(angle)
+    return affineMany(geoms, np.column_stack((cos, -sin, sin, cos,
+        x0 - x0 * cos + y0 * sin, y0 - x0 * sin - y0 * cos)))
+
+def scaleMany(geoms, x, y, origin='center'):
+    x = np.broadcast_to(np.asarray(x, dtype=np.float64), (len(geoms),))
+    y = np.broadcast_to(np.asarray(y, dtype=np.float64), (len(geoms),))
+    x0, y0 = _getOrigins(geoms, origin).T
+    zeros = np.zeros(len(geoms))
+    return affineMany(geoms, np.column_stack((x, zeros, zeros, y, x0 - x0 * x, y0 - y0 * y)))
+
+def skewMany(geoms, x, y, origin='center'):
+    '''
+    Skews the geometries by the given angles (degrees) along x and y dimensions.
+    '''
+    x = np.tan(np.radians(np.broadcast_to(np.asarray(x, dtype=np.float64), (len(geoms),))))
+    y = np.tan(np.radians(np.broadcast_to(np.asarray(y, dtype=np.float64), (len(geoms),))))
+    x0, y0 = _getOrigins(geoms, origin).T
+    ones = np.ones(len(geoms))
+    return affineMany(geoms, np.column_stack((ones, x, y, ones, -y0 * x, -x0 * y)))
+
 def rotate(geom, angle):
-    gshp = ogr2shapely(geom)
-    rotated = affinity.rotate(gshp, angle, origin='center')
-    return shapely2ogr(rotated)
+    return rotateMany([geom], angle)[0]
 
 def translate(geom, x, y):
-    gshp = ogr2shapely(geom)
-    translated = affinity.translate(gshp, x, y)
-    return shapely2ogr(translated)
+    return translateMany([geom], x, y)[0]
 
 def scale(geom, x, y):
-    gshp = ogr2shapely(geom)
-    scaled = affinity.scale(gshp, x, y, origin='center')
-    return shapely2ogr(scaled)
+    return scaleMany([geom], x, y)[0]
 
 def skew(geom, x, y):
-    gshp = ogr2shapely(geom)
-    skewed = affinity.skew(gshp, x, y, origin='center')
-    return shapely2ogr(skewed)
+    return skewMany([geom], x, y)[0]
 
-def interpolate(start_system, end_system, step):
-    elapsed_time = abs((start_system.timestamp - end_system.timestamp).total_seconds()/60)
-    dx, dy = delta(start_system.geom.Centroid(), end_system.geom.Centroid(), elapsed_time)
+def translateCopies(geom, x, y):
+    '''
+    This method builds translated copies of a single OGR geometry, one for each (x, y) offset.
+    The geometry is exported to WKB only once; the copies are built on a single
+    (copies x WKB size) buffer, where all offsets are applied with broadcasting.
+    \return List of translated OGR geometries.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not len(x):
+        return []
+
+    wkb = bytes(geom.ExportToWkb(ogr.wkbNDR))
+    blocks = []
+    _wkbCoordinateBlocks(wkb, 0, blocks)
+
+    copies = np.tile(np.frombuffer(wkb, dtype=np.uint8), (len(x), 1))
+    for offset, n, dims in blocks:
+        view = copies[:, offset:offset + 8 * n * dims].view('<f8').reshape(len(x), n, dims)
+        view[:, :, 0] += x[:, None]
+        view[:, :, 1] += y[:, None]
+
+    srs = geom.GetSpatialReference()
+    result = []
+    for buffer in copies:
+        t = ogr.CreateGeometryFromWkb(buffer.tobytes())
+        if srs is not None:
+            t.AssignSpatialReference(srs)
+        result.append(t)
+
+    return result
+
+### @end-Affine transforms. ###
+
+def interpolateMany(pairs, step):
+    '''
+    This method interpolates a list of (start_system, end_system) pairs at once.
+    The intermediate geometries of each pair are computed with a single vectorized translation.
+    Interpolated systems share raster and layers with the start system (no copies).
+    '''
     systems = []
-    for t in range(1, int(elapsed_time), step):
-        intepolated_system = copy.deepcopy(start_system)
-        intepolated_system.event = LifeCycleEvent.INTERPOLATION
-        intepolated_system.geom = translate(start_system.geom, -dx * t, -dy * t)
-        intepolated_system.timestamp = start_system.timestamp + timedelta(minutes=t)
-        systems.append(intepolated_system)
+    for start_system, end_system in pairs:
+        elapsed_time = abs((start_system.timestamp - end_system.timestamp).total_seconds()/60)
+        if elapsed_time == 0.0:
+            continue
+        sx, sy = start_system.getCentroid()
+        ex, ey = end_system.getCentroid()
+        dx, dy = (sx - ex)/elapsed_time, (sy - ey)/elapsed_time
+        steps = np.arange(1, int(elapsed_time), step)
+
+        # Start geometry is exported once; offsets of all steps are broadcast
+        geoms = translateCopies(start_system.geom, -dx * steps, -dy * steps)
+
+        for geom, t in zip(geoms, steps):
+            intepolated_system = ConvectiveSystem(geom)
+            intepolated_system.name = start_system.name
+            intepolated_system.event = LifeCycleEvent.INTERPOLATION
+            intepolated_system.timestamp = start_system.timestamp + timedelta(minutes=int(t))
+            intepolated_system.attrs = dict(start_system.attrs)
+            intepolated_system.layers = start_system.layers
+            intepolated_system.raster = start_system.raster
+            intepolated_system.nodata = start_system.nodata
+            intepolated_system.geotransform = start_system.geotransform
+            systems.append(intepolated_system)
+
     return systems
+
+def interpolate(start_system, end_system, step):
+    return interpolateMany([(start_system, end_system)], step)
@@ -6,6 +6,8 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
+import struct
+
 import cv2
 import numpy as np
 from osgeo import ogr
@@ -21,24 +23,70 @@ def extractCoordinates(polygon):
     '''
     This method extract the coordinates of polygon to two python lists.
     '''
-    lats, lons = [], []
-    points = polygon.GetGeometryRef(0).GetPoints()
-    for p in points:
-        lons.append(p[0]); lats.append(p[1])
-    return lats, lons
+    points = np.asarray(polygon.GetGeometryRef(0).GetPoints())
+    return points[:, 1].tolist(), points[:, 0].tolist()
 
 def extractCoordinates2NumpyArray(polygon):
     '''
     This method extract the coordinates of polygon to NumpyArray (N x 2).
     '''
-    points = polygon.GetGeometryRef(0).GetPoints()
-    coords = np.zeros((len(points), 2), dtype=np.float32)
-    i = 0
-    for p in points:
-        coords[i,0] = p[0]
-        coords[i,1] = p[1]
-        i += 1
-    return coords
+    points = np.asarray(polygon.GetGeometryRef(0).GetPoints(), dtype=np.float32)
+    return np.ascontiguousarray(points[:, :2])
+
+def polygon2array(polygon):
+    '''
+    This method extract the coordinates of all polygon rings to a single NumpyArray (N x 2).
+    It also returns the number of points of each ring.
+    '''
+    rings = []
+    for i in range(polygon.GetGeometryCount()):
+        rings.append(np.asarray(polygon.GetGeometryRef(i).GetPoints(), dtype=np.float64)[:, :2])
+    return np.concatenate(rings), [len(r) for r in rings]
+
+def array2polygon(coords, sizes):
+    '''
+    This method builds a polygon from ring coordinates (N x 2), through WKB representation.
+    '''
+    parts = [struct.pack('<BII', 1, ogr.wkbPolygon, len(sizes))]
+    start = 0
+    for n in sizes:
+        parts.append(struct.pack('<I', n))
+        parts.append(np.ascontiguousarray(coords[start:start + n], dtype='<f8').tobytes())
+        start += n
+    return ogr.CreateGeometryFromWkb(b''.join(parts))
+
+def countPoints(geom):
+    '''
+    This method returns the number of vertices of the given geometry.
+    '''
+    n = geom.GetPointCount()
+    for i in range(geom.GetGeometryCount()):
+        n += countPoints(geom.GetGeometryRef(i))
+    return n
+
+def removeCollinearPoints(polygon, eps=1e-12):
+    '''
+    This method removes the collinear vertices of polygon rings (e.g. runs of pixel edges).
+    Shape, area and topology are kept unchanged.
+    '''
+    coords, sizes = polygon2array(polygon)
+    rings, start = [], 0
+    for n in sizes:
+        # Closed ring: ignore the repeated last point
+        pts = coords[start:start + n - 1]
+        start += n
+        prev, next = np.roll(pts, 1, axis=0), np.roll(pts, -1, axis=0)
+        # Cross-product between consecutive edges
+        cross = (pts[:, 0] - prev[:, 0]) * (next[:, 1] - pts[:, 1]) - \
+                (pts[:, 1] - prev[:, 1]) * (next[:, 0] - pts[:, 0])
+        kept = pts[np.abs(cross) > eps]
+        if len(kept) < 3:
+            kept = pts
+        rings.append(np.concatenate((kept, kept[:1])))
+    simplified = array2polygon(np.concatenate(rings), [len(r) for r in rings])
+    if polygon.GetSpatialReference() is not None:
+        simplified.AssignSpatialReference(polygon.GetSpatialReference())
+    return simplified
 
 def extent2polygon(extent):
     '''
@@ -95,27 +143,32 @@ def ellipse2polygon(x, y, ra, rb, ang, npoints=32):
     written by Peter Blattner, Institute of Microtechnology,
     University of Neuchatel, Switzerland, blattner@imt.unine.ch
     '''
-    xpos, ypos = x,y
-    radm, radn= ra,rb
-    an = ang
+    return ellipses2polygons([(x, y, ra, rb, ang)], npoints)[0]
+
+def ellipses2polygons(ellipses, npoints=32):
+    '''
+    Create polygons based on a list of ellipse parameters (x, y, ra, rb, ang).
+    The rings of all ellipses are computed at once.
+    '''
+    if not len(ellipses):
+        return []
 
-    co, si = np.cos(an),np.sin(an)
-    the=np.linspace(0, 2 * np.pi, npoints)
-    X=radm * np.cos(the) * co-si * radn * np.sin(the) + xpos
-    Y=radm * np.cos(the) * si+co * radn * np.sin(the) +ypos
+    xpos, ypos, radm, radn, an = (c[:, np.newaxis] for c in np.asarray(ellipses, dtype=np.float64).T)
 
-    # Create OGR Polygon
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    for x, y in zip(X,Y):
-        ring.AddPoint(x, y)
-    ring.AddPoint(X[0], Y[0])
+    co, si = np.cos(an), np.sin(an)
+    the = np.linspace(0, 2 * np.pi, npoints)
+    X = radm * np.cos(the) * co - si * radn * np.sin(the) + xpos
+    Y = radm * np.cos(the) * si + co * radn * np.sin(the) + ypos
 
-    p = ogr.Geometry(ogr.wkbPolygon)
-    p.AddGeometry(ring)
+    # Close rings
+    X = np.concatenate((X, X[:, :1]), axis=1)
+    Y = np.concatenate((Y, Y[:, :1]), axis=1)
 
-    return p
+    # Create OGR Polygons
+    coords = np.stack((X, Y), axis=-1)
+    return [array2polygon(c, [npoints + 1]) for c in coords]
 
-def fitEllipseCoordinates(coords):
+def fitEllipseParameters(coords):
     # Fit ellipse
     (xc,yc), (a,b), theta = cv2.fitEllipse(coords)
 
@@ -124,7 +177,11 @@ def fitEllipseCoordinates(coords):
     if a < b: major_ax, minor_ax = b, a
     eccentricity = np.sqrt(1 - ((minor_ax * minor_ax)/(major_ax * major_ax)))
 
-    return ellipse2polygon(xc, yc, a * 0.5, b * 0.5, -theta), eccentricity, theta
+    return (xc, yc, a * 0.5, b * 0.5, -theta), eccentricity, theta
+
+def fitEllipseCoordinates(coords):
+    ellipse, eccentricity, theta = fitEllipseParameters(coords)
+    return ellipse2polygon(*ellipse), eccentricity, theta
 
 def fitEllipse(polygon):
     # Extract coordinates to NumpyArray in order to user opencv2.fitEllipse
@@ -133,11 +190,18 @@ def fitEllipse(polygon):
 
 def fitEllipseMultiPolygon(polygons):
     # Extract coordinates to NumpyArray in order to user opencv2.fitEllipse
-    coords = np.zeros((0, 2), dtype=np.float32)
-    for p in polygons:
-        coords = np.concatenate((coords, extractCoordinates2NumpyArray(p)), axis=0)
+    coords = np.concatenate([extractCoordinates2NumpyArray(p) for p in polygons], axis=0)
     return fitEllipseCoordinates(coords)
 
+def fitEllipses(polygons):
+    '''
+    Fit ellipses for a list of polygons at once.
+    \return List of (ellipse, eccentricity, theta) tuples.
+    '''
+    fits = [fitEllipseParameters(extractCoordinates2NumpyArray(p)) for p in polygons]
+    ellipses = ellipses2polygons([f[0] for f in fits])
+    return [(e, f[1], f[2]) for e, f in zip(ellipses, fits)]
+
 def getRadiusFromCircle(polygon):
     # Extract coordinates to NumpyArray in order to user opencv2.minEnclosingCircle
     coords = extractCoordinates2NumpyArray(polygon)
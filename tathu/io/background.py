@@ -0,0 +1,116 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+import queue
+import threading
+import weakref
+
+def _write(outputter, frames, errors):
+    '''
+    Writer thread loop. Note: it does not reference the BackgroundOutputter,
+    so the wrapper can be garbage-collected (and finalized) while it runs.
+    '''
+    while True:
+        # Wait for a frame, then take all pending ones as a batch
+        items = [frames.get()]
+        while True:
+            try:
+                items.append(frames.get_nowait())
+            except queue.Empty:
+                break
+        stop = False
+        try:
+            for item in items:
+                if item is None:
+                    stop = True
+                    continue
+                operation, systems = item
+                getattr(outputter, operation)(systems)
+            if hasattr(outputter, 'flush'):
+                outputter.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for item in items:
+                frames.task_done()
+        if stop:
+            return
+
+def _shutdown(frames, thread):
+    # Write pending frames and stop the writer thread
+    frames.put(None)
+    thread.join()
+
+class BackgroundOutputter(object):
+    """
+    This class wraps an outputter (e.g. spatialite, pgis, icsv or vector) and writes
+    the systems on a dedicated thread, so output does not block the tracking loop.
+    Frames are queued; if the queue is full, output() blocks until the writer catches
+    up (back-pressure). Frames that are pending at once are written as a batch,
+    followed by a single flush (commit), if the outputter supports it.
+    Pending frames are written on close() (that also closes the wrapped outputter),
+    when the wrapper is garbage-collected and at interpreter exit.
+    Exceptions raised by the wrapped outputter are re-raised on the next call.
+    Note: errors that the outputter handles itself are not propagated, e.g.
+    spatialite.Outputter only prints sqlite3.Error.
+    """
+    def __init__(self, outputter, maxsize=8):
+        self.outputter = outputter
+        self.queue = queue.Queue(maxsize)
+        self.errors = []
+        self.thread = threading.Thread(target=_write, args=(outputter, self.queue, self.errors),
+            name='tathu-writer', daemon=True)
+        self.thread.start()
+        # Runs on close(), garbage collection or interpreter exit (whichever comes first)
+        self.finalizer = weakref.finalize(self, _shutdown, self.queue, self.thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        # Delegate other methods (e.g. getThroughput) to the wrapped outputter
+        return getattr(self.__dict__['outputter'], name)
+
+    def output(self, systems):
+        self.__put(('output', systems))
+
+    def release(self, systems):
+        '''
+        Releases the rasters of the given systems, after they are written (see Outputter.release).
+        '''
+        self.__put(('release', systems))
+
+    def flush(self):
+        '''
+        Waits for all queued frames to be written and flushed.
+        '''
+        self.__check()
+        self.queue.join()
+        self.__check()
+
+    def close(self):
+        '''
+        Writes all queued frames, stops the writer thread and closes the wrapped outputter.
+        '''
+        self.finalizer()
+        if hasattr(self.outputter, 'close'):
+            self.outputter.close()
+        self.__check()
+
+    def __put(self, item):
+        self.__check()
+        if not self.finalizer.alive:
+            raise RuntimeError('BackgroundOutputter is closed.')
+        self.queue.put(item)
+
+    def __check(self):
+        if self.errors:
+            raise self.errors.pop(0)
@@ -0,0 +1,121 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+'''
+Compact and versioned blob format for system mini-rasters.
+
+Layout (little-endian):
+    magic (4 bytes, b'TRB1') | codec id (uint8) | dtype (uint8 length + ascii str) |
+    ndim (uint8) | shape (ndim x uint32) | has nodata (uint8) | nodata (float64) | payload
+The payload is the raw (C-order) array bytes, optionally compressed by the codec.
+'''
+
+import bz2
+import io
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'TRB1'
+
+# Registered codecs: name -> (id, compress(data, level), decompress(data))
+CODECS = {}
+
+# Codec id -> name
+CODEC_NAMES = {}
+
+def register_codec(name, id, compress, decompress):
+    '''
+    Registers a codec that can be used to encode raster blobs.
+    '''
+    CODECS[name] = (id, compress, decompress)
+    CODEC_NAMES[id] = name
+
+def _level(level, default):
+    return default if level is None else level
+
+register_codec('none', 0, lambda data, level: data, lambda data: data)
+register_codec('zlib', 1, lambda data, level: zlib.compress(data, _level(level, 6)), zlib.decompress)
+register_codec('bz2', 2, lambda data, level: bz2.compress(data, _level(level, 9)), bz2.decompress)
+register_codec('lzma', 3, lambda data, level: lzma.compress(data, preset=_level(level, 6)), lzma.decompress)
+
+# Optional codecs, if installed
+try:
+    import zstandard
+    register_codec('zstd', 4,
+        lambda data, level: zstandard.ZstdCompressor(level=_level(level, 3)).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+    register_codec('lz4', 5,
+        lambda data, level: lz4.frame.compress(data, compression_level=_level(level, 0)),
+        lz4.frame.decompress)
+except ImportError:
+    pass
+
+def encode(array, codec='zlib', level=None, nodata=None):
+    '''
+    Encodes the given array to the blob format.
+    '''
+    id, compress, decompress = CODECS[codec]
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.str.encode('ascii')
+    header = MAGIC + struct.pack('<BB', id, len(dtype)) + dtype
+    header += struct.pack('<B' + 'I' * array.ndim, array.ndim, *array.shape)
+    header += struct.pack('<Bd', nodata is not None, 0.0 if nodata is None else nodata)
+    return header + compress(array.tobytes(), level)
+
+def decode_header(blob):
+    '''
+    Decodes the blob header.
+    \return Codec name, dtype, shape, nodata and the payload offset.
+    '''
+    offset = len(MAGIC)
+    id, length = struct.unpack_from('<BB', blob, offset)
+    offset += 2
+    dtype = np.dtype(bytes(blob[offset:offset + length]).decode('ascii'))
+    offset += length
+    ndim = struct.unpack_from('<B', blob, offset)[0]
+    shape = struct.unpack_from('<' + 'I' * ndim, blob, offset + 1)
+    offset += 1 + 4 * ndim
+    hasNodata, nodata = struct.unpack_from('<Bd', blob, offset)
+    offset += 9
+    return CODEC_NAMES[id], dtype, shape, nodata if hasNodata else None, offset
+
+def decode(blob, copy=True):
+    '''
+    Decodes the given blob to array. Blobs written with np.save (raw,
+    zlib or bz2 compressed) by older versions are also supported.
+    \param copy If True, the returned array is writable. Otherwise, it can be
+    a read-only view of the blob (or of the decompressed buffer), without copies.
+    '''
+    if not is_encoded(blob):
+        return _decode_legacy(blob)
+    codec, dtype, shape, nodata, offset = decode_header(blob)
+    id, compress, decompress = CODECS[codec]
+    payload = memoryview(blob)[offset:]
+    if codec != 'none':
+        payload = decompress(payload)
+    array = np.frombuffer(payload, dtype=dtype).reshape(shape)
+    return array.copy() if copy else array
+
+def is_encoded(blob):
+    return bytes(blob[:len(MAGIC)]) == MAGIC
+
+def _decode_legacy(blob):
+    blob = bytes(blob)
+    if blob.startswith(b'BZh'):
+        blob = bz2.decompress(blob)
+    elif not blob.startswith(b'\x93NUMPY'):
+        blob = zlib.decompress(blob)
+    return np.load(io.BytesIO(blob))
@@ -10,8 +10,38 @@ import geopandas
 import pandas as pd
 
 from tathu.geometry.transform import ogr2shapely
+from tathu.tracking.system import SystemTable
+
+def table2geopandas(table):
+    # Create dataframe with fixed attributes
+    df = pd.DataFrame({
+        'name': table.names.astype(str),
+        'timestamp': table.timestamps,
+        'event': table.events.astype(str)
+    })
+    # Add dynamic attributes
+    for attr, values in table.attrs.items():
+        df[attr] = values
+
+    # Add geometry
+    df['geom'] = geopandas.GeoSeries.from_wkb(table.wkbs).values
+
+    # Add relationships
+    df['relationships'] = [' '.join(r) for r in table.relationships]
+
+    # Create geo-dataframe
+    gdf = geopandas.GeoDataFrame(df, geometry='geom')
+
+    # Adjust SRS
+    gdf = gdf.set_crs('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
+
+    return gdf
 
 def systems2geopandas(systems):
+    # Columnar systems?
+    if isinstance(systems, SystemTable):
+        return table2geopandas(systems)
+
     # Create dataframe with fixed attributes
     df = pd.DataFrame({
         'name': [str(s.name) for s in systems],
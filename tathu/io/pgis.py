@@ -6,37 +6,56 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
-import io
+import time
 import uuid
-from datetime import datetime
 
 import numpy as np
 import psycopg2
 import psycopg2.extras
 from osgeo import ogr
 
-from tathu.tracking.system import ConvectiveSystem, ConvectiveSystemFamily
+from tathu.io import codec
+from tathu.tracking.system import (ConvectiveSystem, ConvectiveSystemFamily,
+                                   RasterHandle)
+
+compressor = 'zlib'  # See tathu.io.codec.CODECS, e.g. none, zlib, bz2, lzma, zstd, lz4
+level = None         # Compression level (None: codec default)
 
 def bytea2nparray(bytea):
     '''Converts Numpy Array from Postgres to python.'''
-    bdata = io.BytesIO(bytea)
-    bdata.seek(0)
-    return np.load(bdata)
+    return codec.decode(bytea)
 
-def _adapt_array(text):
+def _adapt_array(array):
     '''Converts Numpy Array from python to Postgres.'''
-    out = io.BytesIO()
-    np.save(out, text)
-    out.seek(0)
-    return psycopg2.Binary(out.read())
+    return psycopg2.Binary(codec.encode(array, compressor, level))
 
 psycopg2.extensions.register_adapter(np.ndarray, _adapt_array)
 
+class EncodedRaster(RasterHandle):
+    """
+    This class represents a raster loaded from Postgres/PostGIS Database that is decoded on first access.
+    """
+    def __init__(self, bytea, nodata):
+        self.bytea = bytea
+        self.nodata = nodata
+        self.raster = None
+
+    def load(self):
+        if self.raster is None:
+            # Note: no copy on decode, the conversion below allocates the result
+            raster = codec.decode(self.bytea, copy=False)
+            # Apply mask
+            raster = np.ma.masked_where(raster == self.nodata, raster, False)
+            self.raster = raster/100
+            self.bytea = None
+        return self.raster
+
 class Outputter(object):
     """
     This class can be used to export tracking results to Postgres/PostGIS Database.
     """
-    def __init__(self, host, database, user, pwd, table, attrs, outputRaster=True, raster2int=True):
+    def __init__(self, host, database, user, pwd, table, attrs, outputRaster=True, raster2int=True,
+                 commitEvery=1, pageSize=1000):
         # Store parameters
         self.host = host
         self.database = database
@@ -46,6 +65,18 @@ class Outputter(object):
         self.attrs = attrs
         self.outputRaster = outputRaster
         self.raster2int = raster2int # Convert raster to int16 (disk-usage)?
+        self.commitEvery = commitEvery # Number of frames (output calls) per transaction.
+        self.pageSize = pageSize # Number of systems per INSERT statement.
+
+        # Statistics (throughput)
+        self.nframes = 0
+        self.nsystems = 0
+        self.elapsed = 0.0
+
+        # Multi-row insert command and row template (built once). Geometry goes as WKB.
+        columns = ['name', 'date_time'] + list(attrs) + ['event', 'relations', 'raster', 'nodata', 'geotransform', 'geom']
+        self.insertCmd = 'INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES %s'
+        self.template = '(' + '%s, ' * (len(columns) - 1) + 'ST_GeomFromWKB(%s, 4326))'
 
         # Prepare connection
         self.conn = psycopg2.connect(host=host, database=database, user=user, password=pwd)
@@ -54,6 +85,7 @@ class Outputter(object):
         self.__createTable(table)
 
     def __del__(self):
+        self.flush()
         self.conn.close()
 
     def output(self, systems):
@@ -61,14 +93,45 @@ class Outputter(object):
         if not systems:
             return
 
+        start = time.perf_counter()
+
         cur = self.conn.cursor()
 
-        for s in systems:
-            self.__insertSystem(s, cur)
+        # Savepoint per frame: a failed frame does not discard the pending (uncommitted) ones
+        cur.execute('SAVEPOINT tathu_frame')
+        try:
+            # One round trip per page of systems
+            psycopg2.extras.execute_values(cur, self.insertCmd, [self.__system2tuple(s) for s in systems],
+                template=self.template, page_size=self.pageSize)
+
+            cur.execute('RELEASE SAVEPOINT tathu_frame')
+        except Exception:
+            cur.execute('ROLLBACK TO SAVEPOINT tathu_frame')
+            raise
+        finally:
+            cur.close()
+
+        # One transaction per N frames
+        self.nframes += 1
+        if self.nframes % self.commitEvery == 0:
+            self.conn.commit()
+
+        self.nsystems += len(systems)
+        self.elapsed += time.perf_counter() - start
 
-        cur.close()
+    def flush(self):
+        try:
+            self.conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(error)
 
-        self.conn.commit()
+    def getThroughput(self):
+        '''
+        Returns the write throughput (systems/s).
+        '''
+        if self.elapsed == 0.0:
+            return 0.0
+        return self.nsystems / self.elapsed
 
     def __createTable(self, table):
 
@@ -94,6 +157,11 @@ class Outputter(object):
 
             cur = self.conn.cursor()
             cur.execute(cmd)
+
+            # Spatial (GiST) and time range indexes
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_' + table + '_geom ON ' + table + ' USING GIST (geom)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_' + table + '_date_time ON ' + table + ' (date_time)')
+
             cur.close()
             self.conn.commit()
 
@@ -102,9 +170,11 @@ class Outputter(object):
 
     def __system2tuple(self, s):
         # Prepare raster data
-        if self.outputRaster:
+        # Systems without raster (e.g. squall lines, interpolated systems) are stored with an empty one
+        raster = s.raster if self.outputRaster else None
+        if raster is not None:
             nodata = s.nodata
-            raster = s.raster.filled(fill_value=nodata)
+            raster = raster.filled(fill_value=nodata)
             # Convert if requested
             if self.raster2int:
                 raster = np.ma.masked_where(raster == nodata, raster)
@@ -120,16 +190,13 @@ class Outputter(object):
         for name in self.attrs:
             tuple += (s.attrs[name],)
 
-        tuple += (str(s.event), s.getRelationshipNames(), raster, nodata, list(s.geotransform), s.getGeomWKT())
+        # Encode raster explicitly, in order to keep nodata on blob header
+        raster = psycopg2.Binary(codec.encode(raster, compressor, level, nodata))
 
-        return tuple
+        tuple += (str(s.event), s.getRelationshipNames(), raster, nodata, list(s.geotransform) if s.geotransform is not None else None,
+            psycopg2.Binary(bytes(s.geom.ExportToWkb())))
 
-    def __insertSystem(self, s, cur):
-        cmd = '''INSERT INTO ''' + self.table + ''' VALUES (default, %s, %s, '''
-        for attr in self.attrs:
-            cmd += '%s, '
-        cmd += '''%s, %s, %s, %s, %s, ST_GeomFromText(%s, 4326))'''
-        cur.execute(cmd, self.__system2tuple(s))
+        return tuple
 
 class Loader(object):
     """
@@ -174,112 +241,143 @@ class Loader(object):
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
 
-    def loadSystemsByDate(self, date):
-        try:
-            cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute('SELECT name FROM ' + self.table + ' WHERE date_time = \'' + str(date) + '\'')
-
-            systems = []
-
-            for row in cur.fetchall():
-                systems.append(self.loadSystem(row['name'], [], date))
-
-            cur.close()
+    def loadSystemsByDate(self, date, attrs=[], with_raster=True):
+        '''
+        Loads all systems of the given timestamp, using a single query.
+        '''
+        sql = 'SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE date_time = %s'
+        return list(self.__iterSystems(sql, (date,), attrs))
+
+    def loadSystemsByDates(self, dates, attrs=[], with_raster=True):
+        '''
+        Loads all systems of the given timestamps, using a single query.
+        \return Dict of timestamp -> list of systems.
+        '''
+        sql = 'SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + \
+            ' WHERE date_time = ANY(%s) ORDER BY date_time'
+        systems = {date: [] for date in dates}
+        for s in self.__iterSystems(sql, (list(dates),), attrs):
+            systems.setdefault(s.timestamp, []).append(s)
+        return systems
+
+    def load(self, name, attrs, with_raster=True):
+        sql = 'SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE name = %s ORDER BY date_time'
+
+        # Create family
+        family = ConvectiveSystemFamily()
+        for s in self.__iterSystems(sql, (str(name),), attrs):
+            family.addSystem(s)
+
+        return family
+
+    def loadSystem(self, name, attrs, date=None, with_raster=True):
+        sql = 'SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE name = %s'
+        params = (str(name),)
+        if date is not None:
+            sql += ' AND date_time = %s'
+            params += (date,)
+        sql += ' ORDER BY date_time LIMIT 1'
+
+        for s in self.__iterSystems(sql, params, attrs):
+            return s
+
+    def queryRegion(self, region, start, end, attrs, with_raster=False, as_columns=False, size=1000):
+        '''
+        Loads the systems that intersect the given region on the [start, end) time range.
+        Candidates are selected by the GiST index on geom and the date_time index.
+        \param region Extent (llx, lly, urx, ury) or OGR geometry. Geometries are also tested exactly.
+        \param start, end Time range (None: unbounded).
+        \return Generator of systems or, if as_columns, a dict of column name -> NumpyArray.
+        '''
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('date_time >= %s')
+            params.append(start)
+        if end is not None:
+            conditions.append('date_time < %s')
+            params.append(end)
+
+        if isinstance(region, ogr.Geometry):
+            wkb = psycopg2.Binary(bytes(region.ExportToWkb()))
+            conditions.append('ST_Intersects(geom, ST_GeomFromWKB(%s, 4326))')
+            params.append(wkb)
+        else:
+            conditions.append('geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)')
+            params += [float(v) for v in region]
 
-            return systems
+        sql = 'SELECT ' + self.__columns(attrs, with_raster and not as_columns) + ' FROM ' + self.table + ' WHERE ' + ' AND '.join(conditions) + ' ORDER BY date_time'
 
-        except (Exception, psycopg2.DatabaseError) as error:
-            print(error)
+        if as_columns:
+            return self.__fetchColumns(sql, params, attrs)
+        return self.__iterSystems(sql, params, attrs, size)
 
-    def load(self, name, attrs):
+    def __fetchColumns(self, sql, params, attrs):
         try:
-            cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-            query = 'SELECT *, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE name=\'' + name + '\' ORDER BY (date_time)'''
-
-            cur.execute(query)
-
-            # Create family
-            family = ConvectiveSystemFamily()
-
-            for row in cur.fetchall():
-                # Load geometry and create object
-                s = ConvectiveSystem(ogr.CreateGeometryFromWkb(bytes(row['wkb'])))
-
-                # Load numeric attributes
-                s.name = uuid.UUID(row['name'])
-                s.timestamp = datetime.strptime(str(row['date_time']), '%Y-%m-%d %H:%M:%S')
-
-                for name in attrs:
-                    s.attrs[name] = row[name]
-
-                s.event = row['event']
-
-                # Load raster data
-                raster = bytea2nparray(row['raster'])
-                nodata = row['nodata']
-
-                # Apply mask
-                raster = np.ma.masked_where(raster == nodata, raster, False)
-
-                s.raster = raster/100
-                s.nodata = nodata/100
-                s.geotransform = row['geotransform']
-
-                s.relationships = row['relations']
-
-                family.addSystem(s)
-
+            cur = self.conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
             cur.close()
 
-            return family
-
-        except (Exception, psycopg2.DatabaseError) as error:
-            print(error)
-
-    def loadSystem(self, name, attrs, date=None):
-        try:
-            cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-            query = 'SELECT *, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE name=\'' + name + '\''
-            query += ' AND date_time = \'' + str(date) + '\''
-            query += ' ORDER BY (date_time)'
-
-            cur.execute(query)
-
-            for row in cur.fetchall():
-                # Load geometry and create object
-                s = ConvectiveSystem(ogr.CreateGeometryFromWkb(bytes(row['wkb'])))
-
-                # Load numeric attributes
-                s.name = uuid.UUID(row['name'])
-                s.timestamp = datetime.strptime(str(row['date_time']), '%Y-%m-%d %H:%M:%S')
+            values = list(zip(*rows)) if rows else [()] * (7 + len(attrs))
+            result = {
+                'name': np.array([str(name) for name in values[0]], dtype=str),
+                'date_time': np.array(values[1], dtype='datetime64[us]'),
+                'event': np.array(values[2], dtype=str)
+            }
+            for i, attr in enumerate(attrs):
+                result[attr] = np.array(values[6 + i], dtype=np.float64)
+            result['wkb'] = np.array([bytes(wkb) for wkb in values[-1]], dtype=object)
 
-                for name in attrs:
-                    s.attrs[name] = row[name]
-
-                s.event = row['event']
-
-                # Load raster data
-                raster = bytea2nparray(row['raster'])
-                nodata = row['nodata']
-
-                # Apply mask
-                raster = np.ma.masked_where(raster == nodata, raster, False)
-
-                s.raster = raster/100
-                s.nodata = nodata/100
-                s.geotransform = row['geotransform']
-
-                s.relationships = row['relations']
-
-                cur.close()
-
-                return s
+            return result
 
         except (Exception, psycopg2.DatabaseError) as error:
             print(error)
 
+    def __columns(self, attrs, with_raster):
+        columns = ['name', 'date_time', 'event', 'relations', 'nodata', 'geotransform'] + list(attrs)
+        if with_raster:
+            columns.append('raster')
+        columns.append('ST_AsBinary(geom) AS wkb')
+        return ', '.join(columns)
+
+    def __iterSystems(self, sql, params, attrs, size=1000):
+        '''
+        Streams the systems of the given query through a named (server-side) cursor,
+        i.e. only size rows are kept on client memory.
+        Note: errors are raised to the caller, since a partial stream could not be told apart
+        from a complete one.
+        '''
+        # Note: cursor is closed even if the caller stops iterating early
+        with self.conn.cursor(name='tathu_' + uuid.uuid4().hex, cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.itersize = size
+            cur.execute(sql, params)
+            for row in cur:
+                yield self.__row2system(row, attrs)
+
+    def __row2system(self, row, attrs):
+        # Load geometry and create object
+        s = ConvectiveSystem(ogr.CreateGeometryFromWkb(bytes(row['wkb'])))
+
+        # Load numeric attributes
+        s.name = uuid.UUID(str(row['name']))
+        s.timestamp = row['date_time']
+
+        for name in attrs:
+            s.attrs[name] = row[name]
+
+        s.event = row['event']
+
+        # Load raster data (lazy)
+        nodata = row['nodata']
+        if 'raster' in row.keys():
+            s.raster = EncodedRaster(row['raster'], nodata)
+        s.nodata = nodata/100
+        s.geotransform = row['geotransform']
+
+        s.relationships = row['relations']
+
+        return s
+
     def query(self, query):
         try:
             cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
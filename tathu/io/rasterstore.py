@@ -0,0 +1,98 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+'''
+External (sidecar) storage for system mini-rasters.
+
+Rasters are appended, encoded by tathu.io.codec, to one binary file per day
+(e.g. rasters-20171001.bin). Each raster is referenced by a key in the form
+'<day>:<offset>:<length>', that can be stored on the database row. Files are
+memory-mapped on read, i.e. only the pages of requested rasters are touched.
+'''
+
+import mmap
+import os
+
+from tathu.io import codec
+from tathu.tracking.system import RasterHandle
+
+def default_directory(database):
+    '''
+    Returns the default raster store directory of the given database file.
+    '''
+    return os.path.splitext(database)[0] + '-rasters'
+
+class RasterStore(object):
+    """
+    This class represents a chunked (one file per day) raster store.
+    """
+    def __init__(self, directory, compressor='none', level=None, prefix='rasters'):
+        self.directory = directory
+        self.compressor = compressor
+        self.level = level
+        self.prefix = prefix
+        # Memory-maps of day files: day -> mmap
+        self.maps = {}
+
+    def path(self, day):
+        return os.path.join(self.directory, self.prefix + '-' + day + '.bin')
+
+    def write(self, timestamp, arrays, nodata=None):
+        '''
+        Appends the given arrays to the day file of the given timestamp.
+        \param nodata Optional list with the nodata value of each array (stored on blob header).
+        \return The list of keys.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        day = timestamp.strftime('%Y%m%d')
+        if nodata is None:
+            nodata = [None] * len(arrays)
+        keys = []
+        with open(self.path(day), 'ab') as f:
+            offset = f.tell()
+            for array, value in zip(arrays, nodata):
+                blob = codec.encode(array, self.compressor, self.level, value)
+                f.write(blob)
+                keys.append(day + ':' + str(offset) + ':' + str(len(blob)))
+                offset += len(blob)
+        return keys
+
+    def read(self, key):
+        '''
+        Reads the array referenced by the given key.
+        Note: if the store is not compressed, the array is a read-only view of the memory-map.
+        '''
+        day, offset, length = key.split(':')
+        offset, length = int(offset), int(length)
+        map = self.__map(day, offset + length)
+        return codec.decode(memoryview(map)[offset:offset + length], copy=False)
+
+    def close(self):
+        # Note: memory-maps are released when no array references them anymore
+        self.maps = {}
+
+    def __map(self, day, size):
+        map = self.maps.get(day)
+        # Not mapped yet or file has grown (e.g. appended by an Outputter)?
+        if map is None or len(map) < size:
+            with open(self.path(day), 'rb') as f:
+                map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[day] = map
+        return map
+
+class StoredRaster(RasterHandle):
+    """
+    This class represents a lazy reference to a system raster stored on a RasterStore.
+    """
+    def __init__(self, store, key, decode):
+        self.store = store
+        self.key = key
+        self.decode = decode
+
+    def load(self):
+        return self.decode(self.store.read(self.key))
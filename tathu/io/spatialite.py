@@ -6,44 +6,32 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
-import bz2
-import io
+import json
 import os
 import pickle
 import sqlite3
+import time
 import uuid
-import zlib
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 
 import numpy as np
 from osgeo import ogr
 
-from tathu.tracking.system import ConvectiveSystem, ConvectiveSystemFamily
+from tathu.geometry.rle import raster2rle
+from tathu.io import codec
+from tathu.io.rasterstore import RasterStore, StoredRaster, default_directory
+from tathu.tracking.system import (ConvectiveSystem, ConvectiveSystemFamily,
+                                   LifeCycleEvent, RasterHandle)
 
-compressor = 'zlib'  # none, zlib, bz2
+compressor = 'zlib'  # See tathu.io.codec.CODECS, e.g. none, zlib, bz2, lzma, zstd, lz4
+level = None         # Compression level (None: codec default)
 
 def adapt_array(arr):
-    """
-    http://stackoverflow.com/a/31312102/190597 (SoulNibbler)
-    """
-    out = io.BytesIO()
-    np.save(out, arr)
-    out.seek(0)
-    if compressor == 'none':
-        return sqlite3.Binary(out.read())
-    elif compressor == 'zlib':
-        return sqlite3.Binary(zlib.compress(out.read()))
-    else:
-        return sqlite3.Binary(out.read().encode(compressor))
+    return sqlite3.Binary(codec.encode(arr, compressor, level))
 
 def convert_array(text):
-    out = io.BytesIO(text)
-    out.seek(0)
-    if compressor == 'zlib':
-        out = io.BytesIO(zlib.decompress(out.read()))
-    elif compressor == 'bz2':
-        out = io.BytesIO(bz2.decompress(out.read()))
-    return np.load(out)
+    return codec.decode(text)
 
 # Register Numpy Array adapter and converter
 sqlite3.register_adapter(np.ndarray, adapt_array)
@@ -63,17 +51,162 @@ sqlite3.register_converter('tuple', pickle.loads)
 sqlite3.register_adapter(list, adapt_list)
 sqlite3.register_converter('list', pickle.loads)
 
+def decode_raster(raster, nodata):
+    # Read-only (e.g. memory-mapped) raster? Note: int16 rasters are copied by the conversion below
+    if not raster.flags.writeable and raster.dtype != np.int16:
+        raster = raster.copy()
+    # Apply mask
+    raster = np.ma.masked_where(raster == nodata, raster, False)
+    # Convert back from int16, if necessary
+    if raster.dtype == np.int16:
+        raster = raster/100.0
+    return raster
+
+# Date/time directives, from coarsest to finest, and the period each one defines
+_DATE_DIRECTIVES = [('%Y', None), ('%m', None), ('%d', timedelta(days=1)),
+                    ('%H', timedelta(hours=1)), ('%M', timedelta(minutes=1)), ('%S', timedelta(seconds=1))]
+
+def date_range(format, date):
+    '''
+    Converts a formatted date to a [start, end) time range, in order to use sargable
+    predicates on date_time column. Returns None if the format does not define a
+    contiguous period (e.g. '%H' only, i.e. a given hour of any day).
+    '''
+    directives = [d for d, period in _DATE_DIRECTIVES if d in format]
+    expected = [d for d, period in _DATE_DIRECTIVES[:len(directives)]]
+    if not directives or directives != expected or format.count('%') != len(directives):
+        return None
+    start = datetime.strptime(date, format)
+    finest = directives[-1]
+    if finest == '%Y':
+        return start, start.replace(year=start.year + 1)
+    if finest == '%m':
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+    return start, start + dict(_DATE_DIRECTIVES)[finest]
+
+class DatabaseRaster(RasterHandle):
+    """
+    This class represents a lazy reference to a system raster stored on SQLite/SpatiaLite Database.
+    If a raster store is given, the raster is read from it, through the key stored on the table.
+    """
+    def __init__(self, conn, table, name, timestamp, store=None):
+        self.conn = conn
+        self.table = table
+        self.name = name
+        self.timestamp = timestamp
+        self.store = store
+
+    def load(self):
+        try:
+            cur = self.conn.cursor()
+            column = 'raster_key' if self.store is not None else 'CAST(raster AS BLOB) AS raster'
+            cur.execute('SELECT ' + column + ', nodata FROM ' + self.table + ' WHERE name=? AND date_time=?',
+                (str(self.name), self.timestamp))
+            row = cur.fetchone()
+            cur.close()
+            if row is None:
+                return None
+            if self.store is not None:
+                return decode_raster(self.store.read(row['raster_key']), row['nodata'])
+            return decode_raster(codec.decode(row['raster'], copy=False), row['nodata'])
+        except sqlite3.Error as e:
+            print(e)
+
+def reencode(database, table, compressor='zlib', level=None, batch=1000):
+    '''
+    Re-encodes the rasters stored on the given SQLite/SpatiaLite Database
+    using the given codec, e.g. to migrate databases written by older versions.
+    Note: rasters stored on an external RasterStore (sidecar .bin files, rows with
+    raster = NULL) are not re-encoded.
+    \return The number of re-encoded rasters.
+    '''
+    conn = sqlite3.connect(database)
+    n = 0
+    try:
+        last = 0
+        while True:
+            rows = conn.execute('SELECT id, raster, nodata FROM ' + table + ' WHERE id > ? AND raster IS NOT NULL ORDER BY id LIMIT ?',
+                (last, batch)).fetchall()
+            if not rows:
+                break
+            conn.executemany('UPDATE ' + table + ' SET raster = ? WHERE id = ?',
+                ((sqlite3.Binary(codec.encode(codec.decode(raster), compressor, level, nodata)), id) for id, raster, nodata in rows))
+            conn.commit()
+            last = rows[-1][0]
+            n += len(rows)
+    finally:
+        conn.close()
+    return n
+
+class EncodedRaster(RasterHandle):
+    """
+    This class represents a raster loaded from SQLite/SpatiaLite Database that is decoded on first access.
+    """
+    def __init__(self, blob, nodata):
+        self.blob = blob
+        self.nodata = nodata
+        self.raster = None
+
+    def load(self):
+        if self.raster is None:
+            # Note: no copy on decode, decode_raster allocates the result (or copies read-only non-int16 arrays)
+            self.raster = decode_raster(codec.decode(self.blob, copy=False), self.nodata)
+            self.blob = None
+        return self.raster
+
 class Outputter(object):
     """
     This class can be used to export tracking results to SQLite/SpatiaLite Database.
     """
-    def __init__(self, database, table, attrs, outputRaster=True, raster2int=True):
+    def __init__(self, database, table, attrs, outputRaster=True, raster2int=True,
+                 commitEvery=1, journalMode='WAL', synchronous='NORMAL', cacheSize=-65536,
+                 rasterStore=None, footprint='polygon'):
         # Store parameters
         self.database = database
         self.table = table
         self.attrs = attrs
-        self.outputRaster = outputRaster
+        # Footprint storage: 'polygon' or 'rle' (polygon + run-length encoded mask).
+        # Note: on 'rle' mode, runs replace the raster, i.e. rasters are not stored.
+        self.footprint = footprint
+        self.outputRaster = outputRaster and footprint != 'rle'
         self.raster2int = raster2int # Convert raster to int16 (disk-usage)?
+        self.commitEvery = commitEvery # Number of frames (output calls) per transaction.
+
+        # External raster store (sidecar files), if requested. True: default directory.
+        if rasterStore is True:
+            rasterStore = default_directory(database)
+        if isinstance(rasterStore, str):
+            rasterStore = RasterStore(rasterStore)
+        self.store = rasterStore
+
+        # Statistics (throughput)
+        self.nframes = 0
+        self.nsystems = 0
+        self.elapsed = 0.0
+
+        # Insert command (built once)
+        columns = ['name', 'date_time'] + list(attrs) + ['event', 'relationships', 'raster', 'nodata', 'geotransform']
+        if self.store is not None:
+            columns.append('raster_key')
+        if self.footprint == 'rle':
+            columns.append('footprint')
+        self.insertCmd = '''INSERT INTO ''' + table + ' (' + ', '.join(columns) + ''', geom) VALUES (''' + \
+            '?, ' * len(columns) + '''ST_GeomFromWKB(?, 4326))'''
+
+        # Family summary upsert command (built once)
+        self.familiesTable = table + '_families'
+        self.upsertFamilyCmd = '''INSERT INTO ''' + self.familiesTable + ''' VALUES (?, ?, ?, 0.0, 1, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                first_time = MIN(first_time, excluded.first_time),
+                last_time = MAX(last_time, excluded.last_time),
+                duration = cast((strftime('%s', MAX(last_time, excluded.last_time)) - strftime('%s', MIN(first_time, excluded.first_time))) as real)/60/60,
+                nsystems = nsystems + 1,
+                max_area = MAX(max_area, excluded.max_area),
+                min_tb = COALESCE(MIN(min_tb, excluded.min_tb), min_tb, excluded.min_tb),
+                has_split = MAX(has_split, excluded.has_split),
+                has_merge = MAX(has_merge, excluded.has_merge)'''
 
         try:
             # Verify if is necessary call InitSpatialMetadata() function
@@ -89,6 +222,14 @@ class Outputter(object):
             self.conn.enable_load_extension(True)
             self.conn.execute('SELECT load_extension("mod_spatialite")')
 
+            # Adjust write performance settings
+            if journalMode:
+                self.conn.execute('PRAGMA journal_mode=' + journalMode)
+            if synchronous:
+                self.conn.execute('PRAGMA synchronous=' + synchronous)
+            if cacheSize:
+                self.conn.execute('PRAGMA cache_size=' + str(cacheSize))
+
             # Create spatial metadata tables, if necessary
             if initSpatialMetadata:
                 cur = self.conn.cursor()
@@ -98,11 +239,33 @@ class Outputter(object):
             # Create table
             self.__createTable(table)
 
+            # Create indexes, if necessary
+            self.__createIndexes(table)
+
+            # Create family summary table, if necessary
+            self.__createFamiliesTable(table)
+
+            # Add raster key and footprint columns, if necessary
+            if self.store is not None:
+                self.__addColumn(table, 'raster_key', 'TEXT')
+            if self.footprint == 'rle':
+                self.__addColumn(table, 'footprint', 'array')
+
         except sqlite3.Error as e:
             print(e)
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        '''
+        Commits pending frames and closes the connection.
+        '''
+        if self.conn is None:
+            return
+        self.flush()
         self.conn.close()
+        self.conn = None
 
     def output(self, systems):
         try:
@@ -110,18 +273,62 @@ class Outputter(object):
             if not systems:
                 return
 
-            cur = self.conn.cursor()
+            start = time.perf_counter()
+
+            rasters = [self.__prepareRaster(s) for s in systems]
+            keys = [None] * len(rasters)
+
+            # Write rasters to the external store, keeping only the keys on table
+            if self.store is not None and self.outputRaster:
+                keys = self.store.write(systems[0].timestamp, [raster for raster, nodata in rasters],
+                    [nodata for raster, nodata in rasters])
+                rasters = [(None, nodata) for raster, nodata in rasters]
 
-            for s in systems:
-                self.__insertSystem(s, cur)
+            cur = self.conn.cursor()
+            cur.executemany(self.insertCmd, (self.__system2tuple(s, raster, nodata, key)
+                for s, (raster, nodata), key in zip(systems, rasters, keys)))
 
+            # Update family summaries
+            cur.executemany(self.upsertFamilyCmd, (self.__system2family(s) for s in systems))
             cur.close()
 
-            self.conn.commit()
+            # One transaction per N frames
+            self.nframes += 1
+            if self.nframes % self.commitEvery == 0:
+                self.conn.commit()
+
+            self.nsystems += len(systems)
+            self.elapsed += time.perf_counter() - start
 
         except sqlite3.Error as e:
             print(e)
 
+    def flush(self):
+        try:
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(e)
+
+    def getThroughput(self):
+        '''
+        Returns the write throughput (systems/s).
+        '''
+        if self.elapsed == 0.0:
+            return 0.0
+        return self.nsystems / self.elapsed
+
+    def release(self, systems):
+        '''
+        This method releases the rasters of already persisted systems.
+        If rasters are stored, they are replaced by handles that load them on demand,
+        i.e. systems of any persisted frame can be released.
+        '''
+        for s in systems:
+            handle = None
+            if self.outputRaster:
+                handle = DatabaseRaster(self.conn, self.table, s.name, s.timestamp, self.store)
+            s.releaseRaster(handle)
+
     def __tableExists(self, table):
         cur = self.conn.cursor()
         cmd = "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='" + table + "'"
@@ -166,11 +373,77 @@ class Outputter(object):
         except sqlite3.Error as e:
             print(e)
 
-    def __system2tuple(self, s):
-        # Prepare raster data
-        if self.outputRaster:
+    def __createIndexes(self, table):
+        try:
+            cur = self.conn.cursor()
+            # B-tree indexes: family lookup (name, date_time) and time range queries
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_' + table + '_name ON ' + table + '(name, date_time)')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_' + table + '_date_time ON ' + table + '(date_time)')
+
+            # Spatial index (R*Tree), also for tables created before it was introduced
+            cur.execute("SELECT spatial_index_enabled FROM geometry_columns WHERE f_table_name = lower(?) AND f_geometry_column = 'geom'",
+                (table,))
+            row = cur.fetchone()
+            if row is not None and not row[0]:
+                cur.execute("SELECT CreateSpatialIndex(?, 'geom')", (table,))
+
+            cur.close()
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(e)
+
+    def __createFamiliesTable(self, table):
+        if self.__tableExists(self.familiesTable):
+            return
+
+        try:
+            cur = self.conn.cursor()
+            cur.execute('''CREATE TABLE ''' + self.familiesTable + '''(
+                name TEXT PRIMARY KEY,
+                first_time TIMESTAMP,
+                last_time TIMESTAMP,
+                duration REAL,
+                nsystems INTEGER,
+                max_area REAL,
+                min_tb REAL,
+                has_split INTEGER,
+                has_merge INTEGER)''')
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_' + self.familiesTable + '_duration ON ' + self.familiesTable + '(duration)')
+
+            # Summarize already stored systems, if any
+            minTb = 'MIN(min)' if 'min' in self.attrs else 'NULL'
+            cur.execute('''INSERT INTO ''' + self.familiesTable + '''
+                SELECT name, MIN(date_time), MAX(date_time),
+                    cast((strftime('%s', MAX(date_time)) - strftime('%s', MIN(date_time))) as real)/60/60, COUNT(*),
+                    MAX(ST_Area(geom)), ''' + minTb + ''',
+                    MAX(event = 'SPLIT'), MAX(event = 'MERGE')
+                FROM ''' + table + ''' GROUP BY name''')
+            cur.close()
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(e)
+
+    def __system2family(self, s):
+        return (str(s.name), s.timestamp, s.timestamp, s.area, s.attrs.get('min'),
+            int(str(s.event) == str(LifeCycleEvent.SPLIT)), int(str(s.event) == str(LifeCycleEvent.MERGE)))
+
+    def __addColumn(self, table, name, type):
+        try:
+            cur = self.conn.cursor()
+            cur.execute('PRAGMA table_info(' + table + ')')
+            if name not in [row['name'] for row in cur.fetchall()]:
+                cur.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + name + ' ' + type)
+            cur.close()
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(e)
+
+    def __prepareRaster(self, s):
+        # Systems without raster (e.g. squall lines, interpolated systems) are stored with an empty one
+        raster = s.raster if self.outputRaster else None
+        if raster is not None:
             nodata = s.nodata
-            raster = s.raster.filled(fill_value=nodata)
+            raster = raster.filled(fill_value=nodata)
             # Convert if requested
             if self.raster2int:
                 raster = np.ma.masked_where(raster == nodata, raster)
@@ -180,31 +453,45 @@ class Outputter(object):
                 raster = raster.astype(np.int16)
         else:
             nodata, raster = 0, np.zeros((1,1))
+        return raster, nodata
 
+    def __system2tuple(self, s, raster, nodata, key):
         # Build system-tuple
-        tuple = (None, str(s.name), s.timestamp)
+        tuple = (str(s.name), s.timestamp)
         for name in self.attrs:
             tuple += (s.attrs[name],)
 
-        tuple += (str(s.event), s.getRelationshipNamesAsString(), raster, nodata, s.geotransform, s.getGeomWKT())
+        # Encode raster explicitly, in order to keep nodata on blob header
+        if raster is not None:
+            raster = sqlite3.Binary(codec.encode(raster, compressor, level, nodata))
 
-        return tuple
+        tuple += (str(s.event), s.getRelationshipNamesAsString(), raster, nodata, s.geotransform)
+        if self.store is not None:
+            tuple += (key,)
 
-    def __insertSystem(self, s, cur):
-        cmd = '''INSERT INTO ''' + self.table + ''' VALUES (?, ?, ?, '''
-        for attr in self.attrs:
-            cmd += '?, '
-        cmd += '''?, ?, ?, ?, ?, ST_GeomFromText(?, 4326))'''
-        cur.execute(cmd, self.__system2tuple(s))
+        if self.footprint == 'rle':
+            # Footprint as runs (replaces the raster), e.g. for rle.overlaps. Note: the polygon
+            # is still stored on geom, so spatial queries and SQL functions remain exact.
+            runs = None
+            if s.raster is not None and s.geotransform is not None:
+                runs = raster2rle(s.raster, s.geotransform)
+            tuple += (runs,)
+        tuple += (bytes(s.geom.ExportToWkb()),)
+
+        return tuple
 
 class Loader(object):
     """
     This class can be used to load tracking results from SQLite/SpatiaLite Database.
     """
-    def __init__(self, database, table):
+    def __init__(self, database, table, rasterStore=None):
         # Store parameters
         self.database = database
         self.table = table
+        self.store = None
+        self.hasFootprint = False
+        self.familiesTable = table + '_families'
+        self.hasFamilies = False
 
         try:
             # Make connection
@@ -215,6 +502,17 @@ class Loader(object):
             self.conn.enable_load_extension(True)
             self.conn.execute('SELECT load_extension("mod_spatialite")')
 
+            # Rasters stored on external store (sidecar files)? Footprints as RLE (see loadFootprints)?
+            columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(' + table + ')')]
+            if 'raster_key' in columns:
+                self.store = RasterStore(rasterStore or default_directory(database))
+            self.hasFootprint = 'footprint' in columns
+
+            # Family summary table (maintained by Outputter)?
+            cur = self.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (self.familiesTable,))
+            self.hasFamilies = cur.fetchone()[0] == 1
+            cur.close()
+
         except sqlite3.Error as e:
             print(e)
 
@@ -224,7 +522,10 @@ class Loader(object):
     def loadNames(self):
         try:
             cur = self.conn.cursor()
-            cur.execute('SELECT DISTINCT name FROM ' + self.table)
+            if self.hasFamilies:
+                cur.execute('SELECT name FROM ' + self.familiesTable)
+            else:
+                cur.execute('SELECT DISTINCT name FROM ' + self.table)
 
             names = [row['name'] for row in cur.fetchall()]
 
@@ -237,12 +538,15 @@ class Loader(object):
 
     def loadByDuration(self, hours, operator='>='):
         try:
-            sql = '''SELECT DISTINCT name FROM
+            # Use family summary table, if available. Otherwise, GROUP BY name is resolved by the (name, date_time) covering index
+            sql = 'SELECT name FROM ' + self.familiesTable + ' WHERE duration ' + operator + ' ? ORDER BY duration DESC'
+            if not self.hasFamilies:
+                sql = '''SELECT name FROM
                     (SELECT name, cast((strftime('%s', max(date_time)) - strftime('%s', min(date_time))) as real)/60/60 AS elapsed_time
-                    FROM ''' + self.table + ''' GROUP BY name) AS duration WHERE elapsed_time ''' + operator + str(hours) + ''' ORDER BY elapsed_time DESC'''
+                    FROM ''' + self.table + ''' GROUP BY name) AS duration WHERE elapsed_time ''' + operator + ''' ? ORDER BY elapsed_time DESC'''
 
             cur = self.conn.cursor()
-            cur.execute(sql)
+            cur.execute(sql, (hours,))
 
             names = [row['name'] for row in cur.fetchall()]
 
@@ -255,13 +559,16 @@ class Loader(object):
 
     def loadByInterval(self, start, end):
         try:
-            sql = '''SELECT DISTINCT name FROM
+            # Use family summary table, if available
+            sql = 'SELECT name FROM ' + self.familiesTable + ' WHERE duration >= ? AND duration <= ? ORDER BY duration DESC'
+            if not self.hasFamilies:
+                sql = '''SELECT name FROM
                     (SELECT name, cast((strftime('%s', max(date_time)) - strftime('%s', min(date_time))) as real)/60/60 AS elapsed_time
-                    FROM ''' + self.table + ''' GROUP BY name) AS duration WHERE elapsed_time >=''' + str(start) + '''
-                    AND elapsed_time <=''' + str(end) + ''' ORDER BY elapsed_time DESC'''
+                    FROM ''' + self.table + ''' GROUP BY name) AS duration WHERE elapsed_time >= ?
+                    AND elapsed_time <= ? ORDER BY elapsed_time DESC'''
 
             cur = self.conn.cursor()
-            cur.execute(sql)
+            cur.execute(sql, (start, end))
 
             names = [row['name'] for row in cur.fetchall()]
 
@@ -274,16 +581,15 @@ class Loader(object):
 
     def getLastDate(self, format='%Y%m%d'):
         try:
+            # Note: bare MAX() is resolved by the date_time index
             cur = self.conn.cursor()
-            cur.execute('SELECT strftime(\'' + format + '\', MAX(date_time)) FROM ' + self.table)
-
-            date = None
-            for row in cur.fetchall():
-                date = row[0]
-
+            cur.execute('SELECT MAX(date_time) FROM ' + self.table)
+            date = cur.fetchone()[0]
             cur.close()
 
-            return datetime.strptime(date, format)
+            # Truncate to the given format
+            date = datetime.fromisoformat(str(date))
+            return datetime.strptime(date.strftime(format), format)
 
         except sqlite3.Error as e:
             print(e)
@@ -291,48 +597,222 @@ class Loader(object):
     def getDates(self, format='%Y%m%d%H%M'):
         try:
             cur = self.conn.cursor()
-            cur.execute('SELECT DISTINCT strftime(\'' + format + '\', date_time) FROM ' + self.table)
+            cur.execute('SELECT DISTINCT date_time FROM ' + self.table + ' ORDER BY date_time')
             dates = []
             for row in cur.fetchall():
-                dates.append(datetime.strptime(row[0], format))
+                date = datetime.strptime(datetime.fromisoformat(str(row[0])).strftime(format), format)
+                if not dates or dates[-1] != date:
+                    dates.append(date)
             cur.close()
             return dates
         except sqlite3.Error as e:
             print(e)
 
-    def loadLastSystems(self, attrs):
+    def loadLastSystems(self, attrs, with_raster=True):
         try:
             date = self.getLastDate('%Y-%m-%d %H:%M:00')
+            return self.__loadByRange(date, date + timedelta(minutes=1), attrs, with_raster)
+        except sqlite3.Error as e:
+            print(e)
+
+    def loadByDay(self, day, attrs, with_raster=True):
+        start = datetime.strptime(day, '%Y%m%d')
+        return self.__loadByRange(start, start + timedelta(days=1), attrs, with_raster)
+
+    def loadByDate(self, format, date, attrs, with_raster=True):
+        # Try sargable time range, i.e. that uses the date_time index
+        period = date_range(format, date)
+        if period is not None:
+            return self.__loadByRange(period[0], period[1], attrs, with_raster)
+        try:
             cur = self.conn.cursor()
-            cur.execute('SELECT *, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE date_time=\'' + date.strftime('%Y-%m-%d %H:%M:00') + '\'')
+            cur.execute('SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE strftime(?, date_time) = ?', (format, date))
             return self.__fetchSystems(cur, attrs)
         except sqlite3.Error as e:
             print(e)
 
-    def loadByDay(self, day, attrs):
+    def load(self, name, attrs, with_raster=True):
         try:
             cur = self.conn.cursor()
-            cur.execute('SELECT *, strftime(\'%Y%m%d\', date_time) as day, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE day=\'' + day + '\'')
-            return self.__fetchSystems(cur, attrs)
+            cur.execute('SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE name = ? ORDER BY date_time', (str(name),))
+            return self.__fetchFamily(cur, attrs)
         except sqlite3.Error as e:
             print(e)
 
-    def loadByDate(self, format, date, attrs):
+    def loadFootprints(self, start, end):
+        '''
+        Loads the RLE footprints of systems on the [start, end) time range, without building
+        geometries, e.g. to compute overlaps with tathu.geometry.rle.overlaps.
+        \return List of names, list of timestamps and list of footprints (runs).
+        '''
+        if not self.hasFootprint:
+            return [], [], []
         try:
             cur = self.conn.cursor()
-            cur.execute('SELECT *, strftime(\'' + format + '\', date_time) as date, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE date=\'' + date + '\'')
-            return self.__fetchSystems(cur, attrs)
+            cur.execute('SELECT name, date_time, footprint FROM ' + self.table +
+                ' WHERE date_time >= ? AND date_time < ? AND footprint IS NOT NULL ORDER BY date_time', (start, end))
+            names, timestamps, footprints = [], [], []
+            for row in cur.fetchall():
+                names.append(uuid.UUID(row['name']))
+                timestamps.append(datetime.fromisoformat(str(row['date_time'])))
+                footprints.append(row['footprint'])
+            cur.close()
+            return names, timestamps, footprints
+        except sqlite3.Error as e:
+            print(e)
+
+    def loadFamilies(self, attrs, names=None, where=None, params=(), with_raster=True, size=1000):
+        '''
+        Loads families using a single query, ordered by (name, date_time). Families are yielded
+        one by one as rows are streamed from the cursor, i.e. memory is bounded by a family.
+        \param names Names of the families to load (None: all).
+        \param where Optional SQL condition (with ? placeholders for params), e.g. 'date_time >= ?'.
+        '''
+        conditions = []
+        if names is not None:
+            # Requested names go as a single JSON parameter, in order to avoid a huge IN (...) list.
+            # Note: no temporary table, i.e. no write transaction that would pin the read snapshot
+            conditions.append('name IN (SELECT value FROM json_each(?))')
+            params = (json.dumps([str(name) for name in names]),) + tuple(params)
+        if where is not None:
+            conditions.append('(' + where + ')')
+        sql = 'SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        # Note: errors are raised to the caller, since a partial stream could not be told apart
+        # from a complete one. Cursor is closed even if the caller stops iterating early.
+        cur = self.conn.execute(sql + ' ORDER BY name, date_time', params)
+        try:
+            family, name = None, None
+            rows = cur.fetchmany(size)
+            while rows:
+                for row in rows:
+                    if row['name'] != name:
+                        if family is not None:
+                            yield family
+                        family, name = ConvectiveSystemFamily(), row['name']
+                    family.addSystem(self.__row2system(row, attrs))
+                rows = cur.fetchmany(size)
+
+            if family is not None:
+                yield family
+        finally:
+            cur.close()
+
+    def loadColumns(self, attrs, where=None, params=(), with_geom=False, as_frame=False):
+        '''
+        Loads columns straight to NumpyArrays, i.e. without building ConvectiveSystem objects.
+        Names and events are str arrays, date_time is datetime64[us] and attributes are float64
+        (NULL: nan). If requested, geometries are returned as raw WKB (object array of bytes).
+        \param where Optional SQL condition (with ? placeholders for params), e.g. 'date_time >= ?'.
+        \return Dict of column name -> NumpyArray or, if as_frame, a pandas DataFrame.
+        '''
+        try:
+            # Note: CAST disables the TIMESTAMP converter, i.e. dates are parsed at once by numpy
+            columns = ['name', 'CAST(date_time AS TEXT)', 'event'] + list(attrs)
+            if with_geom:
+                columns.append('ST_AsBinary(geom)')
+            sql = 'SELECT ' + ', '.join(columns) + ' FROM ' + self.table
+            if where is not None:
+                sql += ' WHERE ' + where
+
+            cur = self.conn.cursor()
+            cur.row_factory = None # Plain tuples
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+
+            values = list(zip(*rows)) if rows else [()] * len(columns)
+            result = {
+                'name': np.array(values[0], dtype=str),
+                'date_time': np.array(values[1], dtype='datetime64[us]'),
+                'event': np.array(values[2], dtype=str)
+            }
+            for i, attr in enumerate(attrs):
+                result[attr] = np.array(values[3 + i], dtype=np.float64)
+            if with_geom:
+                result['wkb'] = np.array(values[-1], dtype=object)
+
+            if as_frame:
+                import pandas as pd
+                return pd.DataFrame(result)
+
+            return result
+
         except sqlite3.Error as e:
             print(e)
 
-    def load(self, name, attrs):
+    def queryRegion(self, region, start, end, attrs, with_raster=False, as_columns=False, size=1000):
+        '''
+        Loads the systems that intersect the given region on the [start, end) time range.
+        Candidates are selected by the SpatiaLite R*Tree (SpatialIndex) and the date_time index.
+        \param region Extent (llx, lly, urx, ury) or OGR geometry. Geometries are also tested exactly.
+        \param start, end Time range (None: unbounded).
+        \return Generator of systems or, if as_columns, the columns (see loadColumns).
+        '''
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('date_time >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('date_time < ?')
+            params.append(end)
+
+        if isinstance(region, ogr.Geometry):
+            wkb = bytes(region.ExportToWkb())
+            conditions.append('''ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name = ?
+                AND f_geometry_column = 'geom' AND search_frame = ST_GeomFromWKB(?, 4326))''')
+            conditions.append('ST_Intersects(geom, ST_GeomFromWKB(?, 4326))')
+            params += [self.table, wkb, wkb]
+        else:
+            conditions.append('''ROWID IN (SELECT ROWID FROM SpatialIndex WHERE f_table_name = ?
+                AND f_geometry_column = 'geom' AND search_frame = BuildMbr(?, ?, ?, ?, 4326))''')
+            params += [self.table] + [float(v) for v in region]
+
+        where = ' AND '.join(conditions)
+        if as_columns:
+            return self.loadColumns(attrs, where, params)
+        return self.__iterSystems('SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table +
+            ' WHERE ' + where + ' ORDER BY date_time', params, attrs, size)
+
+    def __iterSystems(self, sql, params, attrs, size):
+        '''
+        Streams the systems of the given query, size rows at a time.
+        Note: errors are raised to the caller, since a partial stream could not be told apart
+        from a complete one.
+        '''
+        cur = self.conn.execute(sql, params)
+        try:
+            rows = cur.fetchmany(size)
+            while rows:
+                for row in rows:
+                    yield self.__row2system(row, attrs)
+                rows = cur.fetchmany(size)
+        finally:
+            cur.close()
+
+    def __loadByRange(self, start, end, attrs, with_raster=True):
         try:
             cur = self.conn.cursor()
-            cur.execute('SELECT *, ST_AsBinary(geom) as wkb FROM ' + self.table + ' WHERE name=\'' + name + '\'')
-            return self.__fetchFamily(cur, attrs)
+            cur.execute('SELECT ' + self.__columns(attrs, with_raster) + ' FROM ' + self.table + ' WHERE date_time >= ? AND date_time < ?', (start, end))
+            return self.__fetchSystems(cur, attrs)
         except sqlite3.Error as e:
             print(e)
 
+    def __columns(self, attrs, with_raster):
+        '''
+        Builds the projection: fixed columns, the requested attributes and, optionally, the raster.
+        Note: the raster is selected as plain BLOB, i.e. it is decoded only on first access.
+        '''
+        columns = ['name', 'date_time', 'event', 'relationships', 'nodata', 'geotransform'] + list(attrs)
+        if with_raster:
+            columns.append('CAST(raster AS BLOB) AS raster')
+            if self.store is not None:
+                columns.append('raster_key')
+        columns.append('ST_AsBinary(geom) AS wkb')
+        return ', '.join(columns)
+
     def execute(self, cmd):
         try:
             cur = self.conn.cursor()
@@ -361,42 +841,35 @@ class Loader(object):
         return family
 
     def __fetchSystems(self, cur, attrs):
-        systems = []
-        for row in cur.fetchall():
-            # Load geometry and create object
-            s = ConvectiveSystem(ogr.CreateGeometryFromWkb(bytes(row['wkb'])))
-
-            # Load numeric attributes
-            s.name = uuid.UUID(row['name'])
-            s.timestamp = datetime.fromisoformat(str(row['date_time']))
-
-            for name in attrs:
-                s.attrs[name] = row[name]
-
-            # Load relationships
-            if row['relationships'] != '':
-                relations = row['relationships'].split(' ')
-                for name in relations:
-                    s.relationships.append(uuid.UUID(name))
-
-            s.event = row['event']
+        systems = [self.__row2system(row, attrs) for row in cur.fetchall()]
+        cur.close()
+        return systems
 
-            # Load raster data
-            raster = row['raster']
-            nodata = row['nodata']
+    def __row2system(self, row, attrs):
+        # Load geometry and create object
+        s = ConvectiveSystem(ogr.CreateGeometryFromWkb(bytes(row['wkb'])))
 
-            # Apply mask
-            raster = np.ma.masked_where(raster == nodata, raster, False)
+        # Load numeric attributes
+        s.name = uuid.UUID(row['name'])
+        s.timestamp = datetime.fromisoformat(str(row['date_time']))
 
-            s.raster = raster
-            if raster.dtype == np.int16:
-                s.raster = raster/100.0
+        for name in attrs:
+            s.attrs[name] = row[name]
 
-            s.nodata = nodata
-            s.geotransform = row['geotransform']
+        # Load relationships
+        if row['relationships'] != '':
+            relations = row['relationships'].split(' ')
+            s.relationships = [uuid.UUID(name) for name in relations]
 
-            systems.append(s)
+        s.event = row['event']
 
-        cur.close()
+        # Load raster data (lazy)
+        nodata = row['nodata']
+        if 'raster_key' in row.keys() and row['raster_key'] is not None:
+            s.raster = StoredRaster(self.store, row['raster_key'], partial(decode_raster, nodata=nodata))
+        elif 'raster' in row.keys():
+            s.raster = EncodedRaster(row['raster'], nodata)
+        s.nodata = nodata
+        s.geotransform = row['geotransform']
 
-        return systems
+        return s
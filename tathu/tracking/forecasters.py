@@ -6,37 +6,47 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
-import copy
 import math
 
+import numpy as np
 from osgeo import ogr
 
 from tathu.geometry import transform
-from tathu.tracking.system import LifeCycleEvent
+from tathu.geometry.utils import array2polygon, polygon2array
+from tathu.tracking.system import ConvectiveSystem, LifeCycleEvent
 
 def compute_distance(p1, p2):
     x = p1.GetX() - p2.GetX()
     y = p1.GetY() - p2.GetY()
     return math.sqrt(x * x + y * y)
 
+def related_systems(sys):
+    '''
+    Returns the related systems that are still available, i.e. name-only
+    relationships (e.g. loaded from a database or garbage-collected) are skipped.
+    '''
+    return [r for r in sys.relationships if isinstance(r, ConvectiveSystem)]
+
 def compute_elapsed_time(sys):
-    if not sys.relationships:
+    related = related_systems(sys)
+    if not related:
         return 0.0
-    return abs((sys.timestamp - sys.relationships[0].timestamp).seconds/60)
+    return abs((sys.timestamp - related[0].timestamp).seconds/60)
 
 def delta(p1, p2, elapsed_time=1.0):
     return (p1.GetX() - p2.GetX())/elapsed_time, (p1.GetY() - p2.GetY())/elapsed_time
 
 def compute_last_centroid(sys):
-    if not sys.relationships:
+    related = related_systems(sys)
+    if not related:
         return None
 
-    if len(sys.relationships) == 1:
-        return sys.relationships[0].geom.Centroid()
+    if len(related) == 1:
+        return related[0].geom.Centroid()
 
     # Compute mean centroid
     x = sys.geom.Centroid().GetX(); y = sys.geom.Centroid().GetY()
-    for r in sys.relationships:
+    for r in related:
         x = (x + r.geom.Centroid().GetX()) * 0.5
         y = (y + r.geom.Centroid().GetY()) * 0.5
 
@@ -46,17 +56,40 @@ def compute_last_centroid(sys):
     return centroid
 
 def compute_scale_factor(sys, elapsed_time=1.0):
-    if not sys.relationships:
+    related = related_systems(sys)
+    if not related:
         return 0.0
 
-    current_area = sys.geom.GetArea()
+    current_area = sys.area
 
     previous_area = 0.0
-    for r in sys.relationships:
-        previous_area += r.geom.GetArea() 
+    for r in related:
+        previous_area += r.area
 
     return ((current_area - previous_area)/previous_area)/elapsed_time
 
+class ForecastSystem(ConvectiveSystem):
+    '''
+    This class represents a lightweight forecast of a convective system.
+    Only the geometry is owned by the forecast; name, attributes, layers,
+    relationships and raster are shared with the source system.
+    '''
+    __slots__ = ('system', 'interval')
+
+    def __init__(self, system, geom, interval):
+        self.system = system
+        self.interval = interval
+        self.geom = geom
+        self.name = system.name
+        self.layers = system.layers
+        self.attrs = system.attrs
+        self.event = system.event
+        self.timestamp = system.timestamp
+        self._relationships = system._relationships
+        self._raster = system._raster
+        self.nodata = system.nodata
+        self.geotransform = system.geotransform
+
 class Conservative(object):
     '''
     This class implements a conservative forecaster.
@@ -90,12 +123,38 @@ class Conservative(object):
             ### Compute scale factor ###
             scale = compute_scale_factor(sys, elapsedtime)
 
-            # Apply transform (for each interval)
+            # Apply transform (for all intervals at once)
+            for t, geom in zip(self.intervals, self.__project(sys, dx, dy, scale)):
+                forecasts[t].append(ForecastSystem(sys, geom, t))
+
+        return forecasts
+
+    def __project(self, sys, dx, dy, scale):
+        intervals = np.asarray(self.intervals, dtype=np.float64)
+
+        # Complex geometries (e.g. multi-polygons) use the general transforms
+        if sys.geom.GetGeometryType() != ogr.wkbPolygon:
+            geoms = []
             for t in self.intervals:
-                prevision = copy.deepcopy(sys)
-                prevision.geom = transform.translate(sys.geom, dx * t, dy * t)
+                geom = transform.translate(sys.geom, dx * t, dy * t)
                 if self.applyScale:
-                    prevision.geom = transform.scale(prevision.geom, 1 + scale * t, 1 + scale * t)
-                forecasts[t].append(prevision)
+                    geom = transform.scale(geom, 1 + scale * t, 1 + scale * t)
+                geoms.append(geom)
+            return geoms
 
-        return forecasts
+        # Extract coordinates once
+        coords, sizes = polygon2array(sys.geom)
+
+        # Scale origin: the center of the (translated) bounding box
+        llx, lly, urx, ury = sys.envelope
+        center = np.array([(llx + urx) * 0.5, (lly + ury) * 0.5])
+
+        # Factors for each interval
+        factors = 1 + scale * intervals if self.applyScale else np.ones_like(intervals)
+        shifts = np.outer(intervals, (dx, dy))
+
+        # Broadcast: (intervals, points, xy)
+        projected = (coords[np.newaxis] - center) * factors[:, np.newaxis, np.newaxis] \
+            + center + shifts[:, np.newaxis, :]
+
+        return [array2polygon(p, sizes) for p in projected]
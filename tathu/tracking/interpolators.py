@@ -0,0 +1,52 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+from tathu.geometry.transform import interpolateMany
+
+def consecutive_pairs(family):
+    '''
+    Returns the pairs of consecutive members (ordered by time) of the given family.
+    '''
+    systems = sorted(family.systems, key=lambda s: s.timestamp)
+    return [(systems[i], systems[i + 1]) for i in range(len(systems) - 1)
+        if systems[i].timestamp != systems[i + 1].timestamp]
+
+class Interpolator(object):
+    '''
+    This class implements a batch temporal interpolator that densifies
+    tracking results, e.g. 1-minute tracks from 10-minute data.
+    Interpolated systems are marked as LifeCycleEvent.INTERPOLATION.
+    '''
+    def __init__(self, step, attrs=[], batch=100):
+        self.step = step   # Interpolation step (minutes).
+        self.attrs = attrs # Attributes that will be loaded and propagated.
+        self.batch = batch # Number of families interpolated at once.
+
+    def interpolate(self, families):
+        pairs = []
+        for family in families:
+            pairs += consecutive_pairs(family)
+        return interpolateMany(pairs, self.step)
+
+    def run(self, loader, outputter, names=None):
+        '''
+        Reads the families from the given loader and streams the interpolated
+        systems to the given outputter. Note: rasters are not loaded nor interpolated,
+        i.e. interpolated systems have raster=None; the database outputters store
+        them with an empty raster (spatialite, pgis); icsv and vector outputters
+        do not export rasters.
+        '''
+        families = []
+        for family in loader.loadFamilies(self.attrs, names, with_raster=False):
+            families.append(family)
+            if len(families) == self.batch:
+                outputter.output(self.interpolate(families))
+                families = []
+
+        if families:
+            outputter.output(self.interpolate(families))
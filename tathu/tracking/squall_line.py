@@ -14,19 +14,72 @@ from osgeo import ogr
 
 from tathu.constants import KM_PER_DEGREE
 from tathu.geometry.utils import fitEllipse
+from tathu.tracking.system import ConvectiveSystem, LifeCycleEvent
+
+def structural_linearity(coords):
+    """
+    Structural linearity index based on PCA.
+    LI = 1 - (λ2 / λ1)
+    λ1 = largest eigenvalue of the covariance matrix
+    λ2 = smallest eigenvalue
+    Returns a value between 0 and 1.
+    """
+    if len(coords) < 3:
+        return 1.0
+    centered = coords - coords.mean(axis=0)
+    cov = np.cov(centered.T)
+    eigvals = np.linalg.eigvalsh(cov)
+    eigvals = np.sort(eigvals)[::-1]
+    l1, l2 = eigvals
+    if l1 == 0:
+        return 0.0
+    return 1.0 - (l2/l1)
+
+def geometric_straightness(coords):
+    """
+    Geometric straightness index.
+    SI = D / L
+    D = distance between the endpoints
+    L = line length
+    Returns a value between 0 and 1.
+    """
+    L = np.sqrt((np.diff(coords, axis=0) ** 2).sum(axis=1)).sum()
+    if L == 0:
+        return 0.0
+    dx, dy = coords[-1] - coords[0]
+    D = np.sqrt(dx * dx + dy * dy)
+    return D / L
+
+def linearity_score(coords):
+    """
+    Score = LI * SI
+    """
+    return structural_linearity(coords) * geometric_straightness(coords)
 
 class SquallLine(object):
     '''
     This class represents a squall line, i.e. a family of convective systems
     that are linearly spatially connected.
+    Scores are computed from the centroid coordinates; the derived geometries
+    (line, axis, buffers, convex hull and ellipse) are computed lazily.
     '''
-    def __init__(self, systems):
+    def __init__(self, systems, centroids=None):
         # Unique identifier
         self.name = uuid.uuid4()
 
+        # Tracking information
+        self.timestamp = systems[0].timestamp if systems else None
+        self.event = LifeCycleEvent.SPONTANEOUS_GENERATION
+        self.relationships = []
+
         # List of systems that composes the squall line
         self.systems = systems
 
+        # Centroid coordinates (N x 2)
+        if centroids is None:
+            centroids = np.array([s.getCentroid() for s in systems], dtype=np.float64)
+        self.centroids = centroids
+
         # Build a invalid extent
         self.__extent = [sys.float_info.max, sys.float_info.max,
             -sys.float_info.max, -sys.float_info.max]
@@ -34,40 +87,82 @@ class SquallLine(object):
         # Compute squall line extent based on the systems that composes it
         self.__computeExtent()
 
-        # Build line geometry based on the centroids of the systems
-        self.line = ogr.Geometry(ogr.wkbLineString)
-        for system in self.systems:
-            # Get centroid
-            centroid = system.geom.Centroid()
-            # Add to Line
-            self.line.AddPoint(centroid.GetX(), centroid.GetY())
+        # Compute linearity score
+        self.linearity_score = linearity_score(self.centroids)
 
-        # Compute main axis
-        self.axis = self.__computeAxis()
+        # Lazy attributes
+        self.__line = None
+        self.__endpoints = None
+        self.__axis = None
+        self.__convex_hull = None
+        self.__ellipse = None
 
+    @property
+    def line(self):
+        # Build line geometry based on the centroids of the systems
+        if self.__line is None:
+            self.__line = ogr.Geometry(ogr.wkbLineString)
+            for x, y in self.centroids:
+                self.__line.AddPoint(float(x), float(y))
+        return self.__line
+
+    @property
+    def endpoints(self):
+        # Compute main axis endpoints (2 x 2)
+        if self.__endpoints is None:
+            self.__endpoints = self.__computeAxis()
+        return self.__endpoints
+
+    @property
+    def axis(self):
+        # Create OGR line
+        if self.__axis is None:
+            p1, p2 = self.endpoints
+            self.__axis = ogr.Geometry(ogr.wkbLineString)
+            self.__axis.AddPoint(float(p1[0]), float(p1[1]))
+            self.__axis.AddPoint(float(p2[0]), float(p2[1]))
+        return self.__axis
+
+    @property
+    def line_bufferred(self):
         # buffer of 0.1 degree (visualization purposes only)
-        self.line_bufferred = self.line.Buffer(0.05)
-        self.axis_bufferred = self.axis.Buffer(0.05)
+        return self.line.Buffer(0.05)
 
-        # Compute convex hull of the polygons that composes the squall line
-        multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
-        for s in self.systems:
-            multipolygon.AddGeometry(s.geom)
-        self.convex_hull = multipolygon.ConvexHull()
+    @property
+    def axis_bufferred(self):
+        # buffer of 0.1 degree (visualization purposes only)
+        return self.axis.Buffer(0.05)
 
+    @property
+    def convex_hull(self):
+        # Compute convex hull of the polygons that composes the squall line
+        if self.__convex_hull is None:
+            multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
+            for s in self.systems:
+                multipolygon.AddGeometry(s.geom)
+            self.__convex_hull = multipolygon.ConvexHull()
+        return self.__convex_hull
+
+    @property
+    def ellipse(self):
+        return self.__fitEllipse()[0]
+
+    @property
+    def eccentricity(self):
+        return self.__fitEllipse()[1]
+
+    @property
+    def theta(self):
+        return self.__fitEllipse()[2]
+
+    def __fitEllipse(self):
         # Fit ellipse to convex hull
-        self.ellipse, self.eccentricity, self.theta = fitEllipse(self.convex_hull)
-
-        # Compute linearity score
-        self.linearity_score = self.linearity_score()
+        if self.__ellipse is None:
+            self.__ellipse = fitEllipse(self.convex_hull)
+        return self.__ellipse
 
     def __computeAxis(self):
-        # Collect centroid coordinates
-        coords = []
-        for system in self.systems:
-            c = system.geom.Centroid()
-            coords.append([c.GetX(), c.GetY()])
-        coords = np.array(coords)
+        coords = self.centroids
         # Compute mean
         mean = coords.mean(axis=0)
         # Center data
@@ -85,11 +180,7 @@ class SquallLine(object):
         # Compute endpoints
         p1 = mean + min_proj * principal_dir
         p2 = mean + max_proj * principal_dir
-        # Create OGR line
-        axis = ogr.Geometry(ogr.wkbLineString)
-        axis.AddPoint(float(p1[0]), float(p1[1]))
-        axis.AddPoint(float(p2[0]), float(p2[1]))
-        return axis
+        return np.array([p1, p2])
 
     def getExtent(self):
         return self.__extent
@@ -105,6 +196,27 @@ class SquallLine(object):
     def getLine(self):
         return self.line
 
+    def getMemberNames(self):
+        return [s.name for s in self.systems]
+
+    def toSystem(self):
+        '''
+        Represents the squall line as a convective system (convex hull geometry),
+        so it can be persisted by the existing outputters.
+        Relationships hold the previous squall line (tracking), as for systems.
+        The member system names go to the 'members' attribute (space-separated text),
+        i.e. export it only with outputters that accept text attributes (e.g. spatialite, icsv).
+        The system has no raster, i.e. it is stored with an empty one.
+        '''
+        s = ConvectiveSystem(self.convex_hull)
+        s.name = self.name
+        s.timestamp = self.timestamp
+        s.event = self.event
+        s.attrs = {'linearity_score': self.linearity_score, 'nsystems': len(self.systems),
+                   'members': ' '.join(str(name) for name in self.getMemberNames())}
+        s.relationships = self.relationships
+        return s
+
     def __computeExtent(self):
         for s in self.systems:
             if s.hasGeom():
@@ -121,55 +233,16 @@ class SquallLine(object):
         self.__extent[3] = max(self.__extent[3], e[3])
 
     def structural_linearity(self):
-        """
-        Structural linearity index based on PCA.
-        LI = 1 - (λ2 / λ1)
-        λ1 = largest eigenvalue of the covariance matrix
-        λ2 = smallest eigenvalue
-        Returns a value between 0 and 1.
-        """
-        pts = np.array(self.line.GetPoints())[:, :2]
-        if len(pts) < 3:
-            return 1.0
-        centered = pts - pts.mean(axis=0)
-        cov = np.cov(centered.T)
-        eigvals = np.linalg.eigvalsh(cov)
-        eigvals = np.sort(eigvals)[::-1]
-        l1, l2 = eigvals
-        if l1 == 0:
-            return 0.0
-        return 1.0 - (l2/l1)
+        return structural_linearity(self.centroids)
 
     def geometric_straightness(self):
-        """
-        Geometric straightness index.
-        SI = D / L
-        D = distance between the endpoints
-        L = line length
-        Returns a value between 0 and 1.
-        """
-        L = self.line.Length()
-        if L == 0:
-            return 0.0
-        p0 = self.line.GetPoint(0)
-        p1 = self.line.GetPoint(self.line.GetPointCount() - 1)
-        dx = p1[0] - p0[0]
-        dy = p1[1] - p0[1]
-        D = np.sqrt(dx * dx + dy * dy)
-        return D / L
-
-    def linearity_score(self):
-        """
-        Score = LI * SI
-        """
-        li = self.structural_linearity()
-        si = self.geometric_straightness()
-        return li * si
+        return geometric_straightness(self.centroids)
 
 class Detector(object):
     '''
     This class implements a convective system detector that
     uses a simple method to define squall lines.
+    Clustering uses a Ball tree with haversine metric (great-circle distances).
     '''
     def __init__(self, systems, min_distance, linearity_threshold, min_nsystems=2):
          # List of convective systems used by the detector.
@@ -184,33 +257,116 @@ class Detector(object):
         # Minimum number of systems to be considered a squall line.
         self.min_nsystems = min_nsystems
 
+    def cluster(self, locations):
+        '''
+        Clusters the given locations (N x 2, lon/lat) using DBSCAN over a radius neighbors graph.
+        \return The cluster label of each location (-1: noise).
+        '''
+        from sklearn.cluster import DBSCAN
+        from sklearn.neighbors import NearestNeighbors
+
+        # Haversine metric: [lat, lon] in radians
+        eps = np.radians(self.min_distance)
+        points = np.radians(locations[:, ::-1])
+
+        neighbors = NearestNeighbors(radius=eps, metric='haversine', algorithm='ball_tree').fit(points)
+
+        graph = neighbors.radius_neighbors_graph(points, mode='distance')
+        db = DBSCAN(eps=eps, min_samples=self.min_nsystems, metric='precomputed').fit(graph)
+
+        return db.labels_
+
     def detect(self, image):
         # List of squall lines that will be defined by the detector
         squall_lines = []
 
+        if len(self.systems) < self.min_nsystems:
+            return squall_lines
+
         # Extract centroids from convective systems
-        centroids = []
-        for s in self.systems:
-            centroids.append(s.geom.Centroid())
+        locations = np.array([s.getCentroid() for s in self.systems], dtype=np.float64)
 
-        # Apply DBSCAN clustering method to define squall lines cores using scypy library
-        from sklearn.cluster import DBSCAN
-        locations = np.array([[c.GetX(), c.GetY()] for c in centroids])
-        db = DBSCAN(eps=self.min_distance, min_samples=self.min_nsystems, n_jobs=-1).fit(locations)
+        # Define squall lines cores
+        labels = self.cluster(locations)
 
         # for each cluster, define a squall line
-        unique_labels = set(db.labels_)
-        for current_label in unique_labels:
+        for current_label in np.unique(labels):
             if current_label == -1:
                 continue
-            systems_cluster = []
-            for i in range(len(db.labels_)):
-                if db.labels_[i] == current_label:
-                    systems_cluster.append(self.systems[i])
 
-            if len(systems_cluster) >= self.min_nsystems:
-                sl = SquallLine(systems_cluster)
-                if(sl.linearity_score >= self.linearity_threshold):
-                    squall_lines.append(sl)
+            members = np.flatnonzero(labels == current_label)
+            if len(members) < self.min_nsystems:
+                continue
+
+            # Score on centroids first; build squall line only if accepted
+            centroids = locations[members]
+            if linearity_score(centroids) >= self.linearity_threshold:
+                squall_lines.append(SquallLine([self.systems[i] for i in members], centroids))
 
         return squall_lines
+
+def axis_overlap(a, b):
+    '''
+    Computes the overlap of the axis a (2 x 2 endpoints) projected onto the axis b,
+    relative to the length of b. Returns a value between 0 and 1.
+    '''
+    direction = b[1] - b[0]
+    length = np.sqrt((direction ** 2).sum())
+    if length == 0:
+        return 0.0
+    direction = direction / length
+    pa = np.sort((a - b[0]) @ direction)
+    return max(0.0, min(pa[1], length) - max(pa[0], 0.0)) / length
+
+def squall_lines2systems(squall_lines):
+    return [sl.toSystem() for sl in squall_lines]
+
+class Tracker(object):
+    '''
+    This class implements a squall line tracker. Squall lines of consecutive frames
+    are matched by the names of their member systems (i.e. the names kept by the system
+    tracker), using hash joins. Ties are broken by the axis overlap.
+    Note: systems of the current frame must be tracked before.
+    '''
+    def __init__(self, previous, min_members=1, min_axis_overlap=0.0):
+        self.previous = previous                 # Squall lines of the previous frame.
+        self.min_members = min_members           # Minimum number of shared member systems.
+        self.min_axis_overlap = min_axis_overlap # Minimum axis overlap (0-1).
+
+    def track(self, current):
+        # Hash: member system name -> previous squall lines indexes
+        members = {}
+        for i, sl in enumerate(self.previous):
+            for name in sl.getMemberNames():
+                members.setdefault(name, []).append(i)
+
+        # Candidates for each current squall line
+        candidates = []
+        for j, sl in enumerate(current):
+            # Count shared members (hash join)
+            shared = {}
+            for name in sl.getMemberNames():
+                for i in members.get(name, []):
+                    shared[i] = shared.get(i, 0) + 1
+            for i, count in shared.items():
+                if count < self.min_members:
+                    continue
+                overlap = axis_overlap(sl.endpoints, self.previous[i].endpoints)
+                if overlap < self.min_axis_overlap:
+                    continue
+                candidates.append((count, overlap, j, i))
+
+        # Greedy assignment: more shared members first, then larger axis overlap
+        candidates.sort(reverse=True)
+        assigned, used = set(), set()
+        for count, overlap, j, i in candidates:
+            if j in assigned or i in used:
+                continue
+            sl, previous = current[j], self.previous[i]
+            sl.name = previous.name # Baptized!
+            sl.event = LifeCycleEvent.CONTINUITY
+            sl.relationships = [previous.name]
+            assigned.add(j)
+            used.add(i)
+
+        return current
@@ -8,11 +8,14 @@
 
 import sys
 import uuid
+import weakref
 from enum import Enum
 
+import numpy as np
+from osgeo import ogr
 from rtree import index
 
-from tathu.geometry.utils import convert2interleaved, fitEllipse
+from tathu.geometry.utils import convert2interleaved, fitEllipse, fitEllipses
 
 class LifeCycleEvent(Enum):
     '''
@@ -28,10 +31,26 @@ class LifeCycleEvent(Enum):
     def __str__(self):
         return self.name
 
+class RasterHandle(object):
+    '''
+    This class represents a lazy reference to a system raster that is stored
+    elsewhere (e.g. an output database). The raster is loaded on demand.
+    '''
+    def load(self):
+        raise NotImplementedError
+
 class ConvectiveSystem(object):
     '''
     This class represents a convective system.
+    Derived geometry (area, centroid and envelope) is computed lazily and
+    cached until the geometry is replaced. Relationships keep only the
+    names and weak references of the related systems, so previous
+    frames can be garbage-collected.
     '''
+    __slots__ = ('name', '_geom', 'layers', 'attrs', 'event', 'timestamp',
+                 '_relationships', '_raster', 'nodata', 'geotransform',
+                 '_area', '_centroid', '_envelope', '__weakref__')
+
     def __init__(self, geom):
         self.name = uuid.uuid4()
         self.geom = geom
@@ -44,38 +63,107 @@ class ConvectiveSystem(object):
         self.nodata = None
         self.geotransform = None
 
+    @property
+    def geom(self):
+        return self._geom
+
+    @geom.setter
+    def geom(self, geom):
+        self._geom = geom
+        # Invalidate cached derived geometry
+        self._area = None
+        self._centroid = None
+        self._envelope = None
+
+    @property
+    def area(self):
+        if self._area is None:
+            self._area = self._geom.GetArea()
+        return self._area
+
+    @property
+    def centroid(self):
+        if self._centroid is None:
+            c = self._geom.Centroid()
+            self._centroid = (c.GetX(), c.GetY())
+        return self._centroid
+
+    @property
+    def envelope(self):
+        '''
+        The geometry extent on interleaved representation, i.e. [llx, lly, urx, ury].
+        '''
+        if self._envelope is None:
+            self._envelope = convert2interleaved(self._geom.GetEnvelope())
+        return self._envelope
+
+    @property
+    def relationships(self):
+        '''
+        Tuple of related systems that are still alive; otherwise, their names.
+        Note: it is immutable, i.e. assign a new list to change the relationships.
+        '''
+        related = []
+        for name, ref in self._relationships:
+            system = ref() if ref is not None else None
+            related.append(system if system is not None else name)
+        return tuple(related)
+
+    @relationships.setter
+    def relationships(self, relationships):
+        self._relationships = []
+        for r in relationships:
+            if isinstance(r, ConvectiveSystem):
+                self._relationships.append((r.name, weakref.ref(r)))
+            else:
+                self._relationships.append((r, None))
+
+    @property
+    def raster(self):
+        if isinstance(self._raster, RasterHandle):
+            return self._raster.load()
+        return self._raster
+
+    @raster.setter
+    def raster(self, raster):
+        self._raster = raster
+
+    def releaseRaster(self, handle=None):
+        '''
+        This method releases the system raster, keeping only the given handle
+        (if any) that can be used to load it again on demand.
+        '''
+        self._raster = handle
+
     def getGeomWKT(self):
         return self.geom.ExportToWkt()
 
     def getCentroid(self):
-        c = self.geom.Centroid()
-        return (c.GetX(), c.GetY())
+        return self.centroid
 
     def getMBR(self):
         '''
         This method get the extent from OGRGeometry encapsulated by system object.
         The retrieved extent is converted automatically to interleaved representation.
         '''
-        return convert2interleaved(self.geom.GetEnvelope())
+        return self.envelope
 
     def hasGeom(self):
-        return self.geom != None
+        return self._geom is not None
 
     def getRelationshipNames(self):
         names = []
-        for r in self.relationships:
-            if r.name != self.name:
-                names.append(str(r.name))
+        for name, ref in self._relationships:
+            # Prefer the current name of related systems that are still alive
+            system = ref() if ref is not None else None
+            if system is not None:
+                name = system.name
+            if name != self.name:
+                names.append(str(name))
         return names
 
     def getRelationshipNamesAsString(self, separator=' '):
-        names = ''
-        for r in self.relationships:
-            if r.name != self.name:
-                names += str(r.name) + separator
-        if names != '':
-            names = names[:-1] # remove last separator
-        return names
+        return separator.join(self.getRelationshipNames())
 
     def getAttrNames(self):
         return list(self.attrs.keys())
@@ -90,6 +178,32 @@ class ConvectiveSystem(object):
         for name in attrs:
             self.attrs[name] = 0
 
+    def __reduce__(self):
+        # Geometries go as WKB, relationships as names only and rasters as plain
+        # arrays, that are sent as out-of-band buffers on pickle protocol 5
+        wkb = bytes(self.geom.ExportToWkb()) if self.hasGeom() else None
+        layers = {key: bytes(layer.ExportToWkb()) for key, layer in self.layers.items()}
+        relationships = [r.name if isinstance(r, ConvectiveSystem) else r for r in self.relationships]
+        raster, mask = self.raster, None
+        if isinstance(raster, np.ma.MaskedArray):
+            raster, mask = raster.data, np.ma.getmaskarray(raster)
+        return (_rebuildSystem, (wkb, self.name, self.timestamp, self.event, self.attrs,
+            layers, relationships, raster, mask, self.nodata, self.geotransform))
+
+def _rebuildSystem(wkb, name, timestamp, event, attrs, layers, relationships,
+                   raster, mask, nodata, geotransform):
+    s = ConvectiveSystem(ogr.CreateGeometryFromWkb(wkb) if wkb is not None else None)
+    s.name = name
+    s.timestamp = timestamp
+    s.event = event
+    s.attrs = attrs
+    s.layers = {key: ogr.CreateGeometryFromWkb(layer) for key, layer in layers.items()}
+    s.relationships = relationships
+    s.raster = np.ma.MaskedArray(raster, mask=mask, copy=False) if mask is not None else raster
+    s.nodata = nodata
+    s.geotransform = geotransform
+    return s
+
 class ConvectiveSystemFamily(object):
     '''
     This class represents a convective system family,
@@ -122,7 +236,7 @@ class ConvectiveSystemFamily(object):
         return p
 
     def getEllipses(self):
-        p = [fitEllipse(s.geom) for s in self.systems]
+        p = fitEllipses([s.geom for s in self.systems])
         return p
 
     def getCentroids(self):
@@ -161,19 +275,112 @@ class ConvectiveSystemFamily(object):
         # Update ury
         self.__extent[3] = max(self.__extent[3], e[3])
 
+    def __reduce__(self):
+        # Extent and time index are rebuilt from the members
+        return (_rebuildFamily, (self.systems,))
+
+def _rebuildFamily(systems):
+    family = ConvectiveSystemFamily()
+    for s in systems:
+        family.addSystem(s)
+    return family
+
+class SystemTable(object):
+    '''
+    This class represents the convective systems of a frame using a columnar
+    layout (struct-of-arrays), i.e. one contiguous array per attribute.
+    Iterating over a table yields ConvectiveSystem views.
+    '''
+    def __init__(self, names, timestamps, events, wkbs, bboxes, attrs=None,
+                 relationships=None, rasters=None, nodata=None, geotransforms=None):
+        self.names = np.asarray(names, dtype=object)
+        self.timestamps = np.asarray(timestamps, dtype=object)
+        self.events = np.asarray(events, dtype=object)
+        self.wkbs = list(wkbs)
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.attrs = attrs if attrs is not None else {}
+        size = len(self.wkbs)
+        self.relationships = relationships if relationships is not None else [[] for i in range(size)]
+        self.rasters = rasters if rasters is not None else [None] * size
+        self.nodata = nodata if nodata is not None else [None] * size
+        self.geotransforms = geotransforms if geotransforms is not None else [None] * size
+
+    @classmethod
+    def fromSystems(cls, systems):
+        attrs = {}
+        if systems:
+            for name in systems[0].attrs:
+                attrs[name] = np.asarray([s.attrs.get(name) for s in systems])
+        return cls([s.name for s in systems],
+                   [s.timestamp for s in systems],
+                   [s.event for s in systems],
+                   [bytes(s.geom.ExportToWkb()) for s in systems],
+                   [s.getMBR() for s in systems],
+                   attrs,
+                   [s.getRelationshipNames() for s in systems],
+                   [s.raster for s in systems],
+                   [s.nodata for s in systems],
+                   [s.geotransform for s in systems])
+
+    def __len__(self):
+        return len(self.wkbs)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        s = ConvectiveSystem(ogr.CreateGeometryFromWkb(self.wkbs[i]))
+        s.name = self.names[i]
+        s.timestamp = self.timestamps[i]
+        s.event = self.events[i]
+        for name, values in self.attrs.items():
+            s.attrs[name] = values[i].item() if isinstance(values[i], np.generic) else values[i]
+        s.relationships = self.relationships[i]
+        s.raster = self.rasters[i]
+        s.nodata = self.nodata[i]
+        s.geotransform = self.geotransforms[i]
+        return s
+
+    def toSystems(self):
+        return list(self)
+
+    def getAttrNames(self):
+        return list(self.attrs.keys())
+
+    def getAttribute(self, attr):
+        return self.attrs[attr]
+
+    def getExtent(self):
+        if not len(self):
+            return None
+        return (self.bboxes[:, 0].min(), self.bboxes[:, 1].min(),
+                self.bboxes[:, 2].max(), self.bboxes[:, 3].max())
+
 class ConvectiveSystemManager(object):
     '''
     This class implements a manager for convective systems objects.
+    Two geometry back ends are available: 'ogr' (r-tree index plus OGR predicates)
+    and 'shapely' (Shapely 2 geometry array plus STRtree), that runs queries as bulk
+    array operations.
     '''
-    def __init__(self, systems):
+    def __init__(self, systems, backend='ogr'):
         self.systems = systems
-        self.rtree = index.Index()
-        self.__build()
+        self.backend = backend
+        if backend == 'shapely':
+            self.__buildShapely()
+        else:
+            self.rtree = index.Index()
+            self.__build()
 
     def getSystemsFromSystem(self, system):
         return self.getSystemsFromGeom(system.geom)
 
     def getSystemsFromGeom(self, geom):
+        if self.backend == 'shapely':
+            hits = self.tree.query(toShapely([geom])[0], predicate='intersects')
+            return [self.systems[i] for i in sorted(hits)]
+
         # Get geometry extent
         e = convert2interleaved(geom.GetEnvelope())
         # Retrieve candidates (using geometry MBR)
@@ -187,6 +394,11 @@ class ConvectiveSystemManager(object):
         return result
 
     def getSystemsFromExtent(self, e):
+        if self.backend == 'shapely':
+            import shapely
+            hits = self.tree.query(shapely.box(*e))
+            return [self.systems[i] for i in sorted(hits)]
+
         # Search r-tree index
         hits = list(self.rtree.intersection(e, objects='raw'))
         # Retrieve found systems
@@ -196,9 +408,42 @@ class ConvectiveSystemManager(object):
 
         return result
 
+    def getOverlaps(self, systems):
+        '''
+        This method computes, in bulk, the overlaps between the given systems and the managed ones.
+        Note: it requires the 'shapely' back end.
+        \return Arrays with the given systems indexes, the managed systems indexes,
+                the intersection areas and a flag that indicates polygonal intersections.
+        '''
+        import shapely
+        geoms = toShapely([s.geom for s in systems])
+        # Pairs (given system, managed system) that intersects
+        current, previous = self.tree.query(geoms, predicate='intersects')
+        # Pairwise intersections
+        intersections = shapely.intersection(geoms[current], self.geoms[previous])
+        areas = shapely.area(intersections)
+        polygonal = shapely.get_dimensions(intersections) == 2
+        return current, previous, areas, polygonal
+
+    def getAreas(self):
+        import shapely
+        return shapely.area(self.geoms)
+
+    def __buildShapely(self):
+        import shapely
+        self.geoms = toShapely([s.geom for s in self.systems])
+        self.tree = shapely.STRtree(self.geoms)
+
     def __build(self):
         i = 0
         # Indexing convective systems using r-tree
         for s in self.systems:
             self.rtree.insert(i, s.getMBR(), obj=i)
             i += 1
+
+def toShapely(geoms):
+    '''
+    Converts a list of OGR geometries to a Shapely 2 geometry array.
+    '''
+    import shapely
+    return shapely.from_wkb([bytes(g.ExportToWkb()) for g in geoms])
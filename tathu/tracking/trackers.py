@@ -6,6 +6,8 @@
 # under the terms of the MIT License; see LICENSE file for more details.
 #
 
+import numpy as np
+
 from tathu.geometry import transform
 from tathu.tracking.system import ConvectiveSystemManager, LifeCycleEvent
 
@@ -22,6 +24,11 @@ class OverlapAreaStrategy:
     def hasRelationship(self, current_system, previous_system):
         raise NotImplementedError
 
+    def hasRelationships(self, current_areas, previous_areas, intersection_areas, polygonal):
+        '''Array-wise version of hasRelationship, used by bulk geometry back ends.
+           It is optional: strategies that do not implement it are evaluated pair by pair.'''
+        raise NotImplementedError
+
 class AbsoluteOverlapAreaStrategy(OverlapAreaStrategy):
     '''Absolute value strategy: it computes the intersection area
        and compares with the given area threshold.'''
@@ -43,6 +50,9 @@ class AbsoluteOverlapAreaStrategy(OverlapAreaStrategy):
 
         return False
 
+    def hasRelationships(self, current_areas, previous_areas, intersection_areas, polygonal):
+        return polygonal & (intersection_areas > self.threshold)
+
 class RelativeOverlapAreaStrategy(OverlapAreaStrategy):
     ''''Relative value strategy: it computes the intersection area and
         compares with the area of current system using percent relation.'''
@@ -56,7 +66,7 @@ class RelativeOverlapAreaStrategy(OverlapAreaStrategy):
             return False
 
         # Compute current area
-        currentarea = current_system.geom.GetArea()
+        currentarea = current_system.area
 
         # Compute intersection area
         intersectionarea = intersection.GetArea()
@@ -70,6 +80,9 @@ class RelativeOverlapAreaStrategy(OverlapAreaStrategy):
 
         return False
 
+    def hasRelationships(self, current_areas, previous_areas, intersection_areas, polygonal):
+        return polygonal & (intersection_areas / current_areas > self.threshold)
+
 class TitanStrategy(OverlapAreaStrategy):
     ''' TITAN Strategy: Thunderstorm Identification, Tracking, Analysis and Nowcasting.
         More info: http://www.rap.ucar.edu/projects/titan/home/storm_tracking.php'''
@@ -83,10 +96,10 @@ class TitanStrategy(OverlapAreaStrategy):
             return False
 
         # Compute old area
-        oldarea = previous_system.geom.GetArea()
+        oldarea = previous_system.area
 
         # Compute current area
-        currentarea = current_system.geom.GetArea()
+        currentarea = current_system.area
 
         # Compute intersection area
         intersectionarea = intersection.GetArea()
@@ -102,6 +115,11 @@ class TitanStrategy(OverlapAreaStrategy):
 
         return False
 
+    def hasRelationships(self, current_areas, previous_areas, intersection_areas, polygonal):
+        f1 = intersection_areas / previous_areas
+        f2 = intersection_areas / current_areas
+        return polygonal & (f1 + f2 >= self.threshold)
+
 class IntersectsStrategy(OverlapAreaStrategy):
     def __init__(self):
         pass
@@ -109,6 +127,9 @@ class IntersectsStrategy(OverlapAreaStrategy):
     def hasRelationship(self, current_system, previous_system):
         return True
 
+    def hasRelationships(self, current_areas, previous_areas, intersection_areas, polygonal):
+        return np.ones(len(intersection_areas), dtype=bool)
+
 ### @end-Overlap area strategies. ###
 
 ### @begin-System picker strategies. ###
@@ -116,7 +137,7 @@ class IntersectsStrategy(OverlapAreaStrategy):
 def pick_system_by_max_area(systems):
     choosen, maxarea = None, 0.0
     for system in systems:
-        area = system.geom.GetArea()
+        area = system.area
         if area > maxarea:
             choosen, maxarea = system, area
     return choosen
@@ -135,14 +156,15 @@ class OverlapAreaTracker(object):
     '''
     This class implements a convective system tracker that uses the overlap area criterion.
     '''
-    def __init__(self, previous, strategy, picker=pick_system_by_max_area):
+    def __init__(self, previous, strategy, picker=pick_system_by_max_area, backend='ogr'):
         self.previous = previous # Set of previous systems at time.
         self.strategy = strategy # The overlap area strategy that will be used.
         self.picker = picker     # System picker strategy that will be used.
+        self.backend = backend   # Geometry back end: 'ogr' or 'shapely' (bulk array operations).
 
     def track(self, current):
-        # Indexing previous convective cells
-        manager = ConvectiveSystemManager(self.previous)
+        # Relationships for each current system
+        related = self.__findRelationships(current)
 
         # Candidates to SPLIT (previous system name -> current system)
         splits = {}
@@ -154,18 +176,7 @@ class OverlapAreaTracker(object):
         merged = {}
 
         # For each current system
-        for sys in current:
-
-            # Get previous systems that overlaps the current system
-            overlaps = manager.getSystemsFromSystem(sys)
-
-            # Used to store the relationships for each system
-            relationships = []
-
-            # For each overlap
-            for over in overlaps:
-                if self.strategy.hasRelationship(sys, over) is True:
-                    relationships.append(over)
+        for sys, relationships in zip(current, related):
 
             # Store relationships for current system
             sys.relationships = relationships
@@ -237,7 +248,7 @@ class OverlapAreaTracker(object):
                 choosen = 0
                 maxarea = 0.0
                 for i in range(0, len(systems)):
-                    area = systems[i].geom.GetArea()
+                    area = systems[i].area
                     if area > maxarea:
                         choosen = i
                         maxarea = area
@@ -247,6 +258,53 @@ class OverlapAreaTracker(object):
                     if i != choosen:
                         current.remove(systems[i])
 
+    def __findRelationships(self, current):
+        if self.backend == 'shapely':
+            return self.__findRelationshipsBulk(current)
+
+        # Indexing previous convective cells
+        manager = ConvectiveSystemManager(self.previous)
+
+        related = []
+        for sys in current:
+            # Get previous systems that overlaps the current system
+            overlaps = manager.getSystemsFromSystem(sys)
+
+            # Used to store the relationships for each system
+            relationships = []
+
+            # For each overlap
+            for over in overlaps:
+                if self.strategy.hasRelationship(sys, over) is True:
+                    relationships.append(over)
+
+            related.append(relationships)
+
+        return related
+
+    def __findRelationshipsBulk(self, current):
+        # Indexing previous convective cells (geometry array)
+        manager = ConvectiveSystemManager(self.previous, backend='shapely')
+
+        # All overlaps at once
+        c, p, areas, polygonal = manager.getOverlaps(current)
+
+        # Apply the strategy criterion array-wise
+        current_areas = np.array([s.area for s in current], dtype=np.float64)
+        previous_areas = manager.getAreas()
+        if type(self.strategy).hasRelationships is not OverlapAreaStrategy.hasRelationships:
+            valid = self.strategy.hasRelationships(current_areas[c], previous_areas[p], areas, polygonal)
+        else:
+            # No array-wise criterion (e.g. user-defined strategy): evaluate candidate pairs one by one
+            valid = np.array([self.strategy.hasRelationship(current[i], self.previous[j]) is True
+                for i, j in zip(c, p)], dtype=bool)
+
+        related = [[] for s in current]
+        for i, j in zip(c[valid], p[valid]):
+            related[i].append(self.previous[j])
+
+        return related
+
     def __assignIdentifier(self, name, relations):
         choosen = self.picker(relations)
         choosen.name = name # Baptized!
@@ -287,9 +345,9 @@ class EdgeTracker(object):
         return right, left
 
     def __verifyTopology(self, source, destination):
-        for s in source:
-            # Spinning around the world
-            translated = transform.translate(s.geom, -360.0, 0.0)
+        # Spinning around the world (all source systems at once)
+        translations = transform.translateMany([s.geom for s in source], -360.0, 0.0)
+        for s, translated in zip(source, translations):
             # Verify topology, assign name and build new geometry
             for d in destination:
                 if translated.Touches(d.geom):
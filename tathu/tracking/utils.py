@@ -9,7 +9,8 @@
 from osgeo import gdal, ogr, osr
 
 from tathu.constants import KM_PER_DEGREE
-from tathu.geometry.utils import extent2edges
+from tathu.geometry.utils import (countPoints, extent2edges,
+                                  removeCollinearPoints)
 
 def copyImage(image):
     driver = gdal.GetDriverByName('MEM')
@@ -48,6 +49,30 @@ def polygonize(image, minArea=None, progress=None):
 
     return polygons
 
+def simplify(systems, tolerance=None, max_area_change=0.01):
+    '''
+    This function simplifies the polygons of the given systems, in order to reduce vertex counts.
+    Collinear vertices (runs of pixel edges) are always removed. If a tolerance is given,
+    topology-preserving simplification is also applied, as long as the relative area change
+    stays below max_area_change.
+    \return The number of vertices before and after simplification.
+    '''
+    before, after = 0, 0
+    for s in systems:
+        geom = s.geom
+        before += countPoints(geom)
+        if geom.GetGeometryType() == ogr.wkbPolygon:
+            geom = removeCollinearPoints(geom)
+        if tolerance:
+            simplified = geom.SimplifyPreserveTopology(tolerance)
+            area = geom.GetArea()
+            if simplified is not None and not simplified.IsEmpty() and area > 0.0 and \
+                    abs(simplified.GetArea() - area) / area <= max_area_change:
+                geom = simplified
+        s.geom = geom
+        after += countPoints(geom)
+    return before, after
+
 def area2degrees(km2):
     return km2/(KM_PER_DEGREE * KM_PER_DEGREE)
 
@@ -430,7 +430,7 @@ class AnimationMapDatabase(animation.TimedAnimation):
         self.map.set_title(self.timestamps[i].strftime("%Y-%m-%d %H:%M:%S UTC"))
 
         # Load systems
-        systems = self.db.loadByDate('%Y%m%d%H%M', self.timestamps[i].strftime('%Y%m%d%H%M'), attrs=['min'])
+        systems = self.db.loadByDate('%Y%m%d%H%M', self.timestamps[i].strftime('%Y%m%d%H%M'), attrs=['min'], with_raster=False)
 
         # Create polygon graphic
         for s in systems:
@@ -0,0 +1,65 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+"""Unit-test for the raster blob codec."""
+
+import bz2
+import io
+import zlib
+
+import numpy as np
+import pytest
+
+from tathu.io import codec
+
+
+@pytest.fixture
+def raster():
+    """Create an int16 mini-raster with a nodata border."""
+    raster = np.arange(-600, 600, dtype=np.int16).reshape(30, 40)
+    raster[0, :] = np.iinfo(np.int16).min
+    return raster
+
+
+@pytest.mark.parametrize('name', sorted(codec.CODECS))
+def test_round_trip(raster, name):
+    blob = codec.encode(raster, name, nodata=np.iinfo(np.int16).min)
+    assert codec.is_encoded(blob)
+
+    decoded = codec.decode(blob)
+    assert decoded.dtype == raster.dtype
+    np.testing.assert_array_equal(decoded, raster)
+
+    compressor, dtype, shape, nodata, offset = codec.decode_header(blob)
+    assert (compressor, dtype, shape, nodata) == (name, raster.dtype, raster.shape, np.iinfo(np.int16).min)
+
+
+def test_round_trip_without_nodata():
+    raster = np.linspace(180.0, 300.0, 12).reshape(3, 4)
+    blob = codec.encode(raster, 'none')
+    np.testing.assert_array_equal(codec.decode(blob), raster)
+    assert codec.decode_header(blob)[3] is None
+
+
+def test_decode_copy(raster):
+    blob = codec.encode(raster, 'none')
+    assert codec.decode(blob).flags.writeable
+    # No copy: a read-only view of the blob
+    view = codec.decode(memoryview(blob), copy=False)
+    assert not view.flags.writeable
+    np.testing.assert_array_equal(view, raster)
+
+
+@pytest.mark.parametrize('compress', [lambda data: data, zlib.compress, bz2.compress])
+def test_decode_legacy(raster, compress):
+    """Blobs written with np.save (raw, zlib or bz2 compressed) by older versions."""
+    out = io.BytesIO()
+    np.save(out, raster)
+    blob = compress(out.getvalue())
+    assert not codec.is_encoded(blob)
+    np.testing.assert_array_equal(codec.decode(blob), raster)
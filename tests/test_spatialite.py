@@ -0,0 +1,70 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+"""Unit-test for SQLite/SpatiaLite query plans."""
+
+import sqlite3
+
+import pytest
+
+spatialite = pytest.importorskip('tathu.io.spatialite')
+
+
+def has_spatialite():
+    """Check if the SpatiaLite extension can be loaded."""
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.enable_load_extension(True)
+        conn.execute('SELECT load_extension("mod_spatialite")')
+        conn.close()
+        return True
+    except (AttributeError, sqlite3.Error):
+        return False
+
+
+pytestmark = pytest.mark.skipif(not has_spatialite(), reason='mod_spatialite is not available')
+
+
+@pytest.fixture
+def loader(tmp_path):
+    """Create an empty systems database and return a Loader to it."""
+    database = str(tmp_path / 'systems.sqlite')
+    outputter = spatialite.Outputter(database, 'systems', ['min'])
+    outputter.close()
+    return spatialite.Loader(database, 'systems')
+
+
+def query_plans(loader, load):
+    """Run the given load function and return the query plans of its SELECT statements."""
+    statements = []
+    loader.conn.set_trace_callback(statements.append)
+    load()
+    loader.conn.set_trace_callback(None)
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith('SELECT'):
+            rows = loader.conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            plans.append(' '.join(str(row[-1]) for row in rows))
+    assert plans
+    return plans
+
+
+def test_load_by_day_uses_date_time_index(loader):
+    for plan in query_plans(loader, lambda: loader.loadByDay('20171001', ['min'])):
+        assert 'USING INDEX idx_systems_date_time' in plan
+
+
+def test_load_by_date_uses_date_time_index(loader):
+    for plan in query_plans(loader, lambda: loader.loadByDate('%Y%m%d%H', '2017100112', ['min'])):
+        assert 'USING INDEX idx_systems_date_time' in plan
+
+
+def test_load_uses_name_index(loader):
+    name = '00000000-0000-0000-0000-000000000000'
+    for plan in query_plans(loader, lambda: loader.load(name, ['min'])):
+        assert 'USING INDEX idx_systems_name' in plan
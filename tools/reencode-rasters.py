@@ -0,0 +1,26 @@
+#
+# This file is part of TATHU - Tracking and Analysis of Thunderstorms.
+# Copyright (C) 2022 INPE.
+#
+# TATHU - Tracking and Analysis of Thunderstorms is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+#
+
+import click
+
+from tathu.io import codec, spatialite
+from tathu.utils import Timer
+
+@click.command()
+@click.option('--database', type=click.Path(exists=True), help='Path to SQLite/SpatiaLite database.', required=True)
+@click.option('--table', default='systems', help='Systems table name.')
+@click.option('--codec', 'compressor', type=click.Choice(sorted(codec.CODECS)), default='zlib', help='Raster codec.')
+@click.option('--level', type=int, default=None, help='Compression level.')
+def main(database, table, compressor, level):
+    '''Re-encode the rasters stored on the database (sidecar raster files are not re-encoded).'''
+    with Timer():
+        n = spatialite.reencode(database, table, compressor, level)
+        print('Re-encoded', n, 'rasters using', compressor)
+
+if __name__ == '__main__':
+    main()